@@ -4,6 +4,7 @@ import math
 
 drivers.LED4.on()
 from vision import Camera, VisionModule
+from vision.objects import in_corridor
 import cv2
 drivers.LED4.off()
 
@@ -52,19 +53,14 @@ def draw(img, objects):
             cv2.FONT_HERSHEY_PLAIN, 1.0, (255, 255, 255))
 
 
-def in_the_way(objs):
+def in_the_way(arr):
 
-    right = 0
-
-    for obj in objs:
-        if (
-                obj.dist > 0 and
-                obj.dist < 25 and
-                obj.rect[0] < 300 and
-                obj.rect[0] + obj.rect[2] > 340):
-            right = max(right, obj.rect[0] + obj.rect[2] - 320)
-
-    return right
+    # Objects closer than 25 spanning the middle of the frame; returns how
+    # far right of the center the rightmost of them extends, or 0
+    blocking = in_corridor(arr, 300, 340, max_dist=25, span=True)
+    if not len(blocking):
+        return 0
+    return int((blocking["rect"][:, 0] + blocking["rect"][:, 2]).max()) - 320
 
 
 if __name__ == '__main__':
@@ -116,7 +112,7 @@ if __name__ == '__main__':
         src = camera.capture()
 
         drivers.LED3.on()
-        objects, mask, cvxhull = mod.process(src)
+        objects, mask, cvxhull = mod.process(src, as_array=True)
         drivers.LED3.off()
 
         # Timekeeping
@@ -4,7 +4,6 @@ import os
 import time
 
 
-CAMERA_FOV = math.radians(62)
 ROBOT_LATERAL = 3 + 5 / 8
 ROBOT_AXIAL = 3 + 3 / 8
 COLORS = {
@@ -30,26 +29,12 @@ def find_blocks(objects):
     return blocks
 
 
-def draw(img, objects):
-    cv2.line(img, (0, 240), (640, 240), (255, 255, 255), 2)
-    for c in objects:
-        cv2.rectangle(
-            img,
-            (c.rect[0], c.rect[1]),
-            (c.rect[0] + c.rect[2], c.rect[1] + c.rect[3]),
-            COLORS.get(c.meta), 3)
-        cv2.putText(
-            img, "{:.2f} {}".format(c.dist, c.meta), (c.rect[0], c.rect[1]),
-            cv2.FONT_HERSHEY_PLAIN, 1.0, (255, 255, 255))
-
-
 def turn_to_block():
     src = camera.capture()
     drivers.LED3.on()
-    objects, mask, cvxhull = mod.process(src)
+    objects, mask, cvxhull = mod.process(src, want={"cube", "obstacle"})
     drivers.LED3.off()
-    draw(src, objects)
-    cv2.imwrite("out.jpg", src)
+    recorder.record(src, objects)
 
     cubes = find_blocks(objects)
     best_cube = None
@@ -71,11 +56,8 @@ def turn_to_block():
 
     # Trying for a cube
     if best_cube != None:
-        midpoint = best_cube.rect[0] + best_cube.rect[2] / 2
-        print("mid", midpoint)
-        arc = (midpoint - 320) / 320 * CAMERA_FOV / 2
-        print("arc", arc)
-        drivers.move(drivers.RobotState(drivers.TURN, -arc))
+        print("bearing", best_cube.bearing)
+        drivers.move(drivers.RobotState(drivers.TURN, best_cube.bearing))
 
     return best_cube
 
@@ -84,7 +66,7 @@ print("Initializing modules...")
 
 drivers.LED4.on()
 from vision import Camera, VisionModule
-import cv2
+from vision.recorder import Recorder
 drivers.init()
 drivers.LED4.off()
 
@@ -101,6 +83,9 @@ os.remove("go")
 print("Go time!")
 camera = Camera()
 mod = VisionModule(width=640, height=480)
+# One slot per frame turn_to_block processes (at most 4 per run); export
+# with ``python -m vision.recorder match.npy <dir>``
+recorder = Recorder("match.npy", camera.shape, slots=8)
 collecting = False
 
 
@@ -141,5 +126,6 @@ if collecting:
             time.time() - collect_start > 2.5))
 
 # Signal done
+recorder.close()
 drivers.LED1.on()
 time.sleep(60)
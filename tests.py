@@ -19,10 +19,10 @@ import os
 import unittest
 from types import ModuleType
 
-__base_name = os.path.basename(os.getcwd())
+__base_dir = os.path.dirname(os.path.realpath(__file__))
 
 
-def get_submodules(module):
+def get_submodules(module, seen=None):
     """Get submodules for a module
 
     Parameters
@@ -30,20 +30,27 @@ def get_submodules(module):
     module : python module
         Module to add recursively. If ```module``` has any other modules
         in it's ```__dict__```, those modules are also added.
+    seen : set or None
+        Names of modules already found; each module is only added once, so
+        that modules importing each other do not recurse forever.
 
     Returns
     module[]
         List of found modules.
     """
 
+    if seen is None:
+        seen = set()
+    seen.add(module.__name__)
     modules = [module]
 
     for key, value in module.__dict__.items():
         if (
                 isinstance(value, ModuleType) and
-                hasattr(value, "__file__") and
-                __base_name in value.__file__):
-            modules += get_submodules(value)
+                value.__name__ not in seen and
+                getattr(value, "__file__", None) and
+                os.path.realpath(value.__file__).startswith(__base_dir)):
+            modules += get_submodules(value, seen)
 
     return modules
 
@@ -60,8 +67,9 @@ def run_tests(modules):
     suite = unittest.TestSuite()
 
     modlist = []
+    seen = set()
     for module in modules:
-        modlist += get_submodules(module)
+        modlist += get_submodules(module, seen)
 
     for mod in modlist:
         suite.addTests(loader.loadTestsFromModule(mod))
@@ -73,9 +81,10 @@ def run_tests(modules):
 if __name__ == "__main__":
 
     import control
+    import vision
     # Add more modules here
     # Ex.
     # import foo
     # import bar
 
-    run_tests([control])
+    run_tests([control, vision])
@@ -1,7 +1,11 @@
-from .camera import Camera, capture_test
+from .adaptive import AdaptiveVision
+from .camera import Camera, FakePiCamera, capture_test
+from .replay import ReplayCamera
+from .tracker import Tracker
 from .vision import VisionModule
 from .vision_thread import VisionModuleThread
 
 __all__ = [
-    "Camera", "VisionModule", "VisionModuleThread", "capture_test"
+    "AdaptiveVision", "Camera", "FakePiCamera", "ReplayCamera", "Tracker",
+    "VisionModule", "VisionModuleThread", "capture_test"
 ]
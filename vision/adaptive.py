@@ -0,0 +1,309 @@
+"""Adaptive-quality vision
+
+Frame cost varies with scene content and with thermal throttling on the Pi.
+``AdaptiveVision`` runs frames through one of a ladder of ``VisionModule``
+configurations (quality levels), and steps down the ladder when the measured
+processing time exceeds a per-frame budget, and back up when there is enough
+headroom.
+
+Levels lower the resolution (erode/dilate kernels are fractions of the image
+width, so they shrink with it), cache the field hull across frames, and
+finally skip the marker stages (see ``DEFAULT_LEVELS``). Results are always
+reported in the coordinates of the full-quality resolution.
+
+Usage
+-----
+mod = AdaptiveVision(budget=0.05)
+objects, mask, cvxhull = mod.process(img)
+print(mod.level, mod.history)
+"""
+
+import collections
+import time
+import unittest
+
+import numpy as np
+
+from .postprocess import scale_rules
+from .vision import VisionModule
+
+
+# Quality levels, best first. "scale" is the resolution relative to the
+# full-quality module, "want" restricts the outputs computed (intersected with
+# the caller's; see ``VisionModule.process``); all other keys are passed to
+# ``VisionModule``.
+DEFAULT_LEVELS = [
+    {},
+    {"hull_refresh": 5},
+    {"scale": 0.75, "hull_refresh": 5},
+    {"scale": 0.5, "hull_refresh": 5},
+    {"scale": 0.5, "hull_refresh": 5, "want": {"field", "cube", "obstacle"}},
+]
+
+
+Switch = collections.namedtuple(
+    "Switch", ["frame", "timestamp", "old", "new", "mean"])
+Switch.__doc__ = """Quality level change
+
+frame is the number of frames processed before the change; mean the mean
+processing time (in seconds) over the window that triggered it.
+"""
+
+
+class QualityController:
+    """Picks a quality level to keep processing time under a budget
+
+    Levels are numbered from 0 (best, slowest). After every ``window``
+    frames, the controller steps down a level if the mean processing time
+    exceeded ``budget``, or up a level if the better level is expected to fit
+    in ``headroom * budget``. The expected cost of the better level is the
+    current cost times the cost ratio between the two levels, measured when
+    the controller last stepped down between them (so that thermal
+    throttling, which slows all levels alike, does not hide the headroom);
+    levels without a measured ratio are tried once the mean is under
+    ``headroom * budget``.
+
+    Parameters
+    ----------
+    levels : int
+        Number of quality levels
+    budget : float
+        Per-frame processing time budget, in seconds
+    window : int
+        Number of frames averaged for each decision
+    headroom : float
+        Fraction of the budget a better level must be expected to fit in
+    history : int
+        Number of level changes kept in ``history``
+
+    Attributes
+    ----------
+    level : int
+        Current quality level
+    history : Switch[]
+        Recent level changes, oldest first
+    ratios : dict
+        Level -> measured cost of the level above it, relative to its own
+    """
+
+    def __init__(self, levels, budget=0.05, window=10, headroom=0.7,
+                 history=100):
+
+        self.levels = levels
+        self.budget = budget
+        self.window = window
+        self.headroom = headroom
+        self.level = 0
+        self.history = collections.deque(maxlen=history)
+        self.ratios = {}
+
+        self.__times = []
+        self.__frames = 0
+        self.__stepped = None
+
+    def update(self, elapsed):
+        """Record the processing time of a frame
+
+        Parameters
+        ----------
+        elapsed : float
+            Processing time, in seconds
+
+        Returns
+        -------
+        int
+            Quality level for the next frame
+        """
+
+        self.__frames += 1
+        self.__times.append(elapsed)
+        if len(self.__times) < self.window:
+            return self.level
+
+        mean = sum(self.__times) / len(self.__times)
+        self.__times = []
+
+        # First window after stepping down: measure the cost ratio between
+        # the two levels
+        if self.__stepped is not None:
+            self.ratios[self.level] = self.__stepped / mean
+            self.__stepped = None
+
+        if mean > self.budget and self.level < self.levels - 1:
+            self.__stepped = mean
+            self.__switch(self.level + 1, mean)
+        elif mean < self.headroom * self.budget and self.level > 0:
+            ratio = self.ratios.get(self.level)
+            if ratio is None or mean * ratio < self.headroom * self.budget:
+                self.__switch(self.level - 1, mean)
+
+        return self.level
+
+    def __switch(self, level, mean):
+        self.history.append(Switch(
+            frame=self.__frames, timestamp=time.time(), old=self.level,
+            new=level, mean=mean))
+        self.level = level
+
+
+class AdaptiveVision:
+    """``VisionModule`` that adapts its quality to a latency budget
+
+    Has the ``VisionModule.process`` interface. Objects, bounding boxes and
+    the field hull are reported in (width, height) coordinates at every
+    level; the field mask is at the current level's resolution.
+
+    Parameters
+    ----------
+    budget : float
+        Per-frame processing time budget, in seconds
+    levels : dict[] or None
+        Quality levels, best first (see ``DEFAULT_LEVELS``)
+    window : int
+        Number of frames averaged for each level decision
+    headroom : float
+        See ``QualityController``
+    width : int
+        Full-quality image width
+    height : int
+        Full-quality image height
+    **options
+        Other ``VisionModule`` arguments, for all levels. Pixel values
+        (``horizon``, ``isolate`` and ``rules``) are given at full quality,
+        and scaled with each level.
+
+    Attributes
+    ----------
+    controller : QualityController
+        Level controller; see ``level`` and ``history``
+    """
+
+    def __init__(self, budget=0.05, levels=None, window=10, headroom=0.7,
+                 width=640, height=480, **options):
+
+        self.levels = DEFAULT_LEVELS if levels is None else levels
+        self.width = width
+        self.height = height
+        self.options = options
+        self.controller = QualityController(
+            len(self.levels), budget=budget, window=window, headroom=headroom)
+
+        # Modules are built when their level is first used; they share the
+        # full-quality module's color classifier
+        self.__modules = {}
+        self.__module(0)
+
+    @property
+    def level(self):
+        """Current quality level"""
+
+        return self.controller.level
+
+    @property
+    def history(self):
+        """Recent quality level changes (see ``QualityController``)"""
+
+        return list(self.controller.history)
+
+    @property
+    def module(self):
+        """``VisionModule`` of the current quality level"""
+
+        return self.__module(self.level)
+
+    def __module(self, level):
+        """Get (building, if needed) the module of a quality level"""
+
+        if level not in self.__modules:
+            options = dict(self.options)
+            options.update(self.levels[level])
+            scale = options.pop("scale", 1)
+            options.pop("want", None)
+
+            # Pixel-valued options are given at full quality (None and
+            # missing values are ``VisionModule``'s defaults)
+            horizon = options.get("horizon")
+            if horizon is None:
+                horizon = VisionModule.HORIZON
+            options["horizon"] = int(horizon * scale)
+            options["isolate"] = options.get("isolate", 5) * scale
+            if options.get("rules"):
+                options["rules"] = scale_rules(options["rules"], scale)
+
+            if self.__modules:
+                options["classifier"] = self.__modules[0].classifier
+            self.__modules[level] = VisionModule(
+                width=int(self.width * scale),
+                height=int(self.height * scale), **options)
+
+        return self.__modules[level]
+
+    def process(self, img, fmt="bgr", want=None, as_array=False):
+        """Process image at the current quality level (see
+        ``VisionModule.process``)"""
+
+        level = self.level
+        module = self.__module(level)
+
+        limit = self.levels[level].get("want")
+        if limit is not None:
+            want = set(limit) if want is None else set(want) & set(limit)
+
+        start = time.perf_counter()
+        objs, mask, cvxhull = module.process(
+            img, fmt=fmt, want=want, as_array=as_array)
+        self.controller.update(time.perf_counter() - start)
+
+        # Back to full-quality coordinates
+        sx = self.width / module.width
+        sy = self.height / module.height
+        if sx != 1 or sy != 1:
+            scale = np.array([sx, sy, sx, sy])
+            if as_array:
+                objs["rect"] = np.round(objs["rect"] * scale)
+            else:
+                objs = [
+                    o._replace(rect=[
+                        int(round(v)) for v in np.multiply(o.rect, scale)])
+                    for o in objs]
+            if cvxhull is not None:
+                cvxhull = np.round(cvxhull * [sx, sy]).astype(cvxhull.dtype)
+
+        return objs, mask, cvxhull
+
+
+class Tests(unittest.TestCase):
+
+    def test_controller(self):
+
+        ctl = QualityController(3, budget=0.05, window=2, headroom=0.7)
+
+        # Too slow: step down until under budget
+        for t in [0.08, 0.08, 0.06, 0.06, 0.03, 0.03]:
+            ctl.update(t)
+        self.assertEqual(ctl.level, 2)
+        self.assertEqual(
+            [(s.old, s.new) for s in ctl.history], [(0, 1), (1, 2)])
+
+        # Level 1 measured twice the cost of level 2; it is expected to fit
+        # in the headroom once level 2 drops under 0.0175
+        self.assertEqual(ctl.ratios, {1: 0.08 / 0.06, 2: 2})
+        for t in [0.03, 0.03, 0.02, 0.02]:
+            ctl.update(t)
+        self.assertEqual(ctl.level, 2)
+        for t in [0.015, 0.015]:
+            ctl.update(t)
+        self.assertEqual(ctl.level, 1)
+        self.assertEqual(ctl.history[-1].new, 1)
+
+    def test_scaled_options(self):
+
+        mod = AdaptiveVision(
+            levels=[{}, {"scale": 0.5}], horizon=None, isolate=8,
+            lut_cache=None)
+        self.assertEqual((mod.module.horizon, mod.module.isolate), (240, 8))
+
+        mod.controller.level = 1
+        self.assertEqual(
+            (mod.module.width, mod.module.horizon, mod.module.isolate),
+            (320, 120, 4))
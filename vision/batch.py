@@ -0,0 +1,172 @@
+"""Batch processing for offline evaluation
+
+Frames are streamed through a ``multiprocessing`` pool; each worker process
+holds its own ``VisionModule``, built with the same options as the module
+the batch was started from. Results are returned in input order.
+
+Usage
+-----
+mod = VisionModule()
+results, stats = mod.process_directory("tests_02", workers=4)
+print(stats)
+"""
+
+import collections
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import cv2
+import numpy as np
+
+from .samples import ALLOWED_EXTENSIONS
+
+
+BatchStats = collections.namedtuple(
+    "BatchStats", ["frames", "seconds", "fps", "workers", "skipped"],
+    defaults=[()])
+BatchStats.__doc__ = """Batch throughput
+
+frames is the number of frames processed, seconds the total wall time and fps
+the aggregate throughput; skipped lists the files ``process_directory`` could
+not read.
+"""
+
+
+# Per-process vision module, set by ``_init_worker``
+_module = None
+_masks = False
+
+
+def _init_worker(cls, options, masks):
+    """Pool initializer; builds this worker's vision module"""
+
+    global _module, _masks
+    _module = cls(**options)
+    _masks = masks
+
+
+def _run(module, img, masks):
+    """Process a single image, detaching the result from module buffers;
+    None if the image could not be read"""
+
+    if img is None:
+        return None
+    objects, mask, cvxhull = module.process(img)
+    return objects, mask.copy() if masks else None, cvxhull
+
+
+def _process_frame(img):
+    return _run(_module, img, _masks)
+
+
+def _process_file(path):
+    return _run(_module, cv2.imread(path), _masks)
+
+
+def _map(module, func, items, workers, masks, chunksize):
+    """Map ``func`` over ``items`` in a worker pool, in order
+
+    Parameters
+    ----------
+    module : VisionModule
+        Module to copy options from
+    func : f(item) -> result
+        Worker function (``_process_frame`` or ``_process_file``)
+    items : iterable
+        Work items
+    workers : int or None
+        Number of worker processes; defaults to the number of CPUs. If 1, the
+        items are processed in this process by ``module`` itself.
+    masks : bool
+        Whether to return field masks; masks are large, and are dropped
+        (returned as None) by default.
+    chunksize : int
+        Number of items handed to a worker at once
+
+    Returns
+    -------
+    (list, BatchStats)
+        Results in input order, and aggregate throughput
+    """
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    start = time.time()
+    if workers == 1:
+        read = cv2.imread if func is _process_file else (lambda img: img)
+        results = [_run(module, read(item), masks) for item in items]
+    else:
+        with multiprocessing.Pool(
+                workers, initializer=_init_worker,
+                initargs=(type(module), module.options, masks)) as pool:
+            results = list(pool.imap(func, items, chunksize))
+    seconds = time.time() - start
+
+    return results, BatchStats(
+        frames=len(results), seconds=seconds,
+        fps=len(results) / seconds if seconds > 0 else 0.0,
+        workers=workers)
+
+
+def process_batch(module, frames, workers=None, masks=False, chunksize=4):
+    """Process a batch of frames (see ``VisionModule.process_batch``)"""
+
+    return _map(module, _process_frame, frames, workers, masks, chunksize)
+
+
+def process_directory(
+        module, path, workers=None, masks=False, chunksize=4):
+    """Process all images in a directory (see
+    ``VisionModule.process_directory``)"""
+
+    files = sorted(
+        f for f in os.listdir(path)
+        if f.split('.')[-1] in ALLOWED_EXTENSIONS)
+    results, stats = _map(
+        module, _process_file, [os.path.join(path, f) for f in files],
+        workers, masks, chunksize)
+
+    # cv2.imread returns None for unreadable files
+    skipped = [f for f, r in zip(files, results) if r is None]
+    results = [(f, r) for f, r in zip(files, results) if r is not None]
+    return results, stats._replace(
+        frames=len(results),
+        fps=len(results) / stats.seconds if stats.seconds > 0 else 0.0,
+        skipped=skipped)
+
+
+class Tests(unittest.TestCase):
+
+    def test_process_directory(self):
+
+        from .samples import BASE_DIR
+        from .vision import VisionModule
+
+        mod = VisionModule()
+        with tempfile.TemporaryDirectory() as tmp:
+            for f in ["1.jpg", "2.jpg"]:
+                shutil.copy(os.path.join(BASE_DIR, f), tmp)
+            with open(os.path.join(tmp, "3.jpg"), "wb") as f:
+                f.write(b"not an image")
+
+            expected = [
+                mod.process(cv2.imread(os.path.join(tmp, f)))[0]
+                for f in ["1.jpg", "2.jpg"]]
+            for workers in [1, 2]:
+                results, stats = mod.process_directory(
+                    tmp, workers=workers, masks=True)
+                self.assertEqual([f for f, _ in results], ["1.jpg", "2.jpg"])
+                self.assertEqual(
+                    (stats.frames, stats.workers, stats.skipped),
+                    (2, workers, ["3.jpg"]))
+                for (_, (objs, mask, _)), e in zip(results, expected):
+                    self.assertEqual(
+                        [(o.meta, o.rect) for o in objs],
+                        [(o.meta, o.rect) for o in e])
+                    self.assertEqual(mask.shape, (mod.height, mod.width))
+                    self.assertTrue(np.any(mask))
@@ -0,0 +1,83 @@
+"""Preallocated image buffers
+
+OpenCV functions accept a ``dst`` argument to write into an existing array
+instead of allocating a new one. ``BufferPool`` hands out named, reusable
+arrays for these, so that steady-state frame processing does not allocate.
+
+Usage
+-----
+pool = BufferPool()
+pool.reserve("mask", 640 * 480)
+
+mask = cv2.inRange(src, lower, upper, dst=pool.get("mask", (480, 640)))
+"""
+
+import math
+
+import numpy as np
+
+
+class BufferPool:
+    """Named pool of reusable buffers
+
+    Each name refers to a single flat block of memory; ``get`` returns a
+    C-contiguous view of the requested shape and type at the start of that
+    block, so one buffer can serve full frames as well as smaller regions of
+    interest. Buffers only grow (once) if a larger view is requested.
+
+    Views of the same name alias each other; callers are responsible for not
+    using a buffer for two live intermediates at once.
+    """
+
+    def __init__(self):
+        self.__buffers = {}
+
+    def reserve(self, name, nbytes):
+        """Preallocate a buffer
+
+        Parameters
+        ----------
+        name : str
+            Buffer name
+        nbytes : int
+            Minimum buffer size, in bytes
+        """
+
+        buf = self.__buffers.get(name)
+        if buf is None or buf.size < nbytes:
+            self.__buffers[name] = np.empty(nbytes, dtype=np.uint8)
+
+    def get(self, name, shape, dtype=np.uint8):
+        """Get a buffer view
+
+        Parameters
+        ----------
+        name : str
+            Buffer name
+        shape : tuple
+            Shape of the view
+        dtype : np.dtype
+            Type of the view
+
+        Returns
+        -------
+        np.array
+            Uninitialized, C-contiguous array backed by the named buffer
+        """
+
+        # Called for every stage of every region; math.prod is an order of
+        # magnitude cheaper than np.prod on a short tuple
+        dtype = np.dtype(dtype)
+        nbytes = math.prod(shape) * dtype.itemsize
+        buf = self.__buffers.get(name)
+        if buf is None or buf.size < nbytes:
+            self.reserve(name, nbytes)
+            buf = self.__buffers[name]
+
+        return buf[:nbytes].view(dtype).reshape(shape)
+
+    @property
+    def nbytes(self):
+        """Total size of all buffers, in bytes"""
+
+        return sum(buf.size for buf in self.__buffers.values())
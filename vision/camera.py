@@ -14,59 +14,387 @@ img = camera.capture()
 camera.save()  # saves current image
 
 camera.close()
+
+Streaming
+---------
+``Camera.stream`` captures continuously from the video port, and yields
+frames as they arrive, written into a small set of preallocated buffers:
+
+for img in camera.stream():
+    objects, mask, cvxhull = mod.process(img)
+    print(camera.fps)
+
+YUV
+---
+``Camera(fmt="yuv420")`` captures the sensor's native planar YUV420 (I420)
+output from the video port instead of BGR, for use with
+``VisionModule(color="yuv")`` and ``process(img, fmt="yuv420")``.
+
+Testing
+-------
+``Camera(source=FakePiCamera(frames))`` runs without a Pi; the stand-in
+source serves the given BGR images (looping) at the configured frame rate.
 """
 
+import abc
+import collections
+import functools
+import itertools
 import time
+import unittest
 
 import cv2
-from picamera import PiCamera
-from picamera.array import PiRGBArray
+import numpy as np
+
+try:
+    from picamera import PiCamera
+except ImportError:
+    # Not running on a Pi; the rest of the vision package is still usable
+    PiCamera = None
+
+
+class _BufferOutput:
+    """File-like capture output writing into a numpy buffer
+
+    picamera writes each captured frame to the output with one or more
+    ``write`` calls; ``rewind`` points the output at the buffer for the next
+    frame.
+    """
+
+    def __init__(self, buf):
+        self.rewind(buf)
+
+    def rewind(self, buf):
+        self.buf = buf.reshape(-1)
+        self.pos = 0
+
+    def write(self, data):
+        n = min(len(data), self.buf.size - self.pos)
+        self.buf[self.pos:self.pos + n] = np.frombuffer(data, np.uint8, n)
+        self.pos += n
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+class FrameSource(abc.ABC):
+    """Base for stand-ins for ``PiCamera``, for running without camera
+    hardware
+
+    Implements the subset of the ``PiCamera`` interface used by ``Camera``;
+    subclasses provide the frames (``read``).
+
+    Parameters
+    ----------
+    realtime : bool
+        If True, frames are paced to their timestamps, or to ``framerate``
+        if they have none; otherwise they are served as fast as they are
+        read.
+    """
+
+    def __init__(self, realtime=True):
+
+        self.realtime = realtime
+        self.resolution = (640, 480)
+        self.framerate = 30
+        self.rotation = 0
+        self.awb_mode = 'auto'
+        self.awb_gains = (1, 1)
+        self.closed = False
+
+        self.__index = 0
+        self.__next = None
+        self.__origin = None
+        self.__last = None
+
+    @abc.abstractmethod
+    def read(self, i, format):
+        """Get frame ``i``
+
+        Parameters
+        ----------
+        i : int
+            Frame index, counting from 0
+        format : str
+            picamera format; 'bgr' or 'yuv'
+
+        Returns
+        -------
+        (np.array, float or None)
+            Frame in ``format`` at ``resolution``, and its timestamp (in
+            seconds), if it has one
+
+        Raises
+        ------
+        EOFError
+            If there are no more frames
+        """
+
+    def convert(self, img, fmt, format):
+        """Convert a frame from picamera format ``fmt`` to ``format`` at
+        ``resolution``"""
+
+        width, height = self.resolution
+        if fmt == 'yuv':
+            if format == 'yuv' and img.shape == (height * 3 // 2, width):
+                return img
+            img = cv2.cvtColor(img, cv2.COLOR_YUV2BGR_I420)
+        if img.shape[:2] != (height, width):
+            img = cv2.resize(img, (width, height))
+        if format == 'yuv':
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2YUV_I420)
+        return img
+
+    def __wait(self, timestamp):
+        """Pace frames to their timestamps, or to the frame rate"""
+
+        if not self.realtime:
+            return
+        now = time.time()
+
+        if timestamp is None:
+            target = now if self.__next is None else self.__next
+            self.__next = max(target, now) + 1 / float(self.framerate)
+        else:
+            # Restart the clock at the first frame, and when looping
+            if self.__origin is None or timestamp < self.__last:
+                self.__origin = now - timestamp
+            self.__last = timestamp
+            target = self.__origin + timestamp
+
+        if target > now:
+            time.sleep(target - now)
+
+    def capture(self, output, format='bgr', use_video_port=False):
+        img, timestamp = self.read(self.__index, format)
+        self.__index += 1
+        self.__wait(timestamp)
+
+        if isinstance(output, np.ndarray):
+            np.copyto(output.reshape(img.shape), img)
+        else:
+            output.write(img.tobytes())
+
+    def capture_continuous(self, output, format='bgr', use_video_port=False):
+        while not self.closed:
+            try:
+                self.capture(output, format, use_video_port)
+            except EOFError:
+                return
+            yield output
+
+    def close(self):
+        self.closed = True
+
+
+class FakePiCamera(FrameSource):
+    """Stand-in for ``PiCamera`` serving given or synthetic frames
+
+    Parameters
+    ----------
+    frames : np.array[] or None
+        BGR images to serve, in order and looping; resized to the camera
+        resolution. If None, a synthetic scene (a block moving across a
+        gradient) is generated.
+    realtime : bool
+        If True, frames are paced to ``framerate``; otherwise they are
+        served as fast as they are read.
+    """
+
+    def __init__(self, frames=None, realtime=True):
+
+        super().__init__(realtime)
+        self.frames = frames
+        self.__cache = {}
+
+    def read(self, i, format):
+
+        if not self.frames:
+            width, height = self.resolution
+            img = np.zeros((height, width, 3), dtype=np.uint8)
+            img[:] = np.linspace(0, 255, width, dtype=np.uint8)[:, None]
+            x = (i * 8) % width
+            img[height // 2:height // 2 + 40, x:x + 40] = (0, 0, 255)
+            return self.convert(img, 'bgr', format), None
+
+        key = (i % len(self.frames), format, self.resolution)
+        if key not in self.__cache:
+            self.__cache[key] = self.convert(
+                self.frames[key[0]], 'bgr', format)
+        return self.__cache[key], None
 
 
 class Camera:
-    """PiCamera interface"""
+    """PiCamera interface
+
+    Parameters
+    ----------
+    fmt : str
+        Capture format; "bgr" for (480, 640, 3) BGR frames, or "yuv420" for
+        (720, 640) planar I420 buffers.
+    framerate : int
+        Sensor frame rate, in frames per second; bounds the ``stream`` rate.
+    source : PiCamera-like or None
+        Camera to capture from; defaults to a new ``PiCamera``. Pass a
+        ``FakePiCamera`` to run without camera hardware.
+    fps_window : int
+        Number of recent frames ``fps`` is measured over
+    resolution : (int, int)
+        Capture resolution, as (width, height)
+
+    Attributes
+    ----------
+    fps : float
+        Capture rate over the last ``fps_window`` frames, in frames per
+        second
+    frame_id : int
+        Number of frames captured
+    """
+
+    def __init__(
+            self, fmt="bgr", framerate=30, source=None, fps_window=30,
+            resolution=(640, 480)):
+
+        if fmt not in ["bgr", "yuv420"]:
+            raise ValueError("Unknown capture format '{}'".format(fmt))
 
-    def __init__(self):
-        self.camera = PiCamera()
+        if source is None:
+            if PiCamera is None:
+                raise RuntimeError(
+                    "picamera is not available on this machine")
+            source = PiCamera()
+
+        self.camera = source
         self.camera.rotation = 180
-        self.camera.resolution = (640, 480)
+        self.camera.resolution = resolution
         self.camera.rotation = 180
         self.camera.awb_mode = 'off'
         self.camera.awb_gains = (1.45, 1.9)
-        self.capture_raw = PiRGBArray(self.camera)
+        self.camera.framerate = framerate
+        self.fmt = fmt
+
+        # picamera writes raw frames straight into a buffer
+        self.capture_raw = np.empty(self.shape, dtype=np.uint8)
+        self.frame = None
 
         self.frame_id = 0
-        self.fps = 0
+        self.fps = 0.0
+        self.__times = collections.deque(maxlen=max(2, fps_window))
         self.start_time = time.time()
 
-    def capture(self):
+    @property
+    def shape(self):
+        """Shape of captured frames"""
+
+        width, height = self.camera.resolution
+        if self.fmt == "yuv420":
+            return (height * 3 // 2, width)
+        return (height, width, 3)
+
+    @property
+    def picamera_format(self):
+        """picamera format name for the capture format"""
+
+        return 'yuv' if self.fmt == "yuv420" else 'bgr'
+
+    def __tick(self):
+        """Record a captured frame"""
+
+        now = time.time()
+        self.__times.append(now)
+        self.frame_id += 1
+        if len(self.__times) > 1:
+            self.fps = (len(self.__times) - 1) / (
+                self.__times[-1] - self.__times[0])
+
+    def capture(self, dst=None):
         """Capture image
 
+        Parameters
+        ----------
+        dst : np.array or None
+            Buffer (of shape ``shape``) to capture into; if None, an internal
+            buffer is used.
+
         Returns
         -------
         np.array
-            reference to image array; NOT UNIQUE PER CAPTURE.
+            reference to image array; NOT UNIQUE PER CAPTURE unless ``dst``
+            is given.
+
+        Raises
+        ------
+        EOFError
+            If the source has no more frames (i.e. a finished replay)
         """
 
-        self.capture_raw.truncate(0)
+        out = self.capture_raw if dst is None else dst
         self.camera.capture(
-            self.capture_raw, format='bgr', use_video_port=True)
+            out, format=self.picamera_format, use_video_port=True)
+        self.frame = out
+        self.__tick()
 
-        self.frame_id += 1
-        self.fps = (time.time() - self.start_time) / self.frame_id
+        return self.frame
+
+    def stream(self, buffers=2, acquire=None):
+        """Capture continuously
+
+        Parameters
+        ----------
+        buffers : int
+            Number of preallocated frame buffers to cycle through. A yielded
+            frame stays valid until ``buffers - 1`` more frames have been
+            captured.
+        acquire : f() -> np.array or None
+            If given, called for the buffer (of shape ``shape``) to capture
+            each frame into, instead of cycling through ``buffers`` (i.e.
+            to capture straight into ``FrameRing`` slots). The buffer for
+            the next frame is acquired once the consumer resumes the
+            generator; if the stream then ends, it is left unused.
 
-        return self.capture_raw.array
+        Yields
+        ------
+        np.array
+            Captured frames. Capture pauses while the consumer holds the
+            generator; closing the generator (i.e. breaking out of the loop)
+            stops capture.
+        """
+
+        if acquire is None:
+            acquire = functools.partial(next, itertools.cycle([
+                np.empty(self.shape, dtype=np.uint8)
+                for _ in range(buffers)]))
+        buf = acquire()
+        output = _BufferOutput(buf)
+
+        frames = self.camera.capture_continuous(
+            output, format=self.picamera_format, use_video_port=True)
+        try:
+            for _ in frames:
+                self.frame = buf
+                self.__tick()
+                yield self.frame
+                buf = acquire()
+                output.rewind(buf)
+        finally:
+            frames.close()
 
     def save(self):
         """Save current frame"""
 
+        img = self.frame
+        if self.fmt == "yuv420":
+            img = cv2.cvtColor(img, cv2.COLOR_YUV2BGR_I420)
+
         print("Saved {}.jpg".format(self.frame_id))
-        cv2.imwrite("{}.jpg".format(self.frame_id), self.capture_raw.array)
+        cv2.imwrite("{}.jpg".format(self.frame_id), img)
 
     def close(self):
         """Close camera"""
 
-        self.camera.close()
+        if hasattr(self, "camera"):
+            self.camera.close()
 
     def __del__(self):
         """Destructor method to ensure camera closing"""
@@ -74,6 +402,46 @@ class Camera:
         self.close()
 
 
+class Tests(unittest.TestCase):
+
+    def test_stream(self):
+
+        frames = [
+            np.full((48, 64, 3), 40 * i, dtype=np.uint8) for i in range(3)]
+        camera = Camera(
+            source=FakePiCamera(frames), framerate=100, fps_window=3,
+            resolution=(64, 48))
+
+        seen, fps = [], []
+        for i, img in enumerate(camera.stream(buffers=2)):
+            self.assertEqual(img.shape, (48, 64, 3))
+            self.assertTrue((img == 40 * (i % 3)).all())
+            seen.append(img)
+            fps.append(camera.fps)
+            if i == 2:
+                # Consumer stall; capture pauses with it
+                time.sleep(0.3)
+            if i == 6:
+                break
+        camera.close()
+
+        # Frames are written into two buffers, alternately
+        self.assertIsNot(seen[0], seen[1])
+        self.assertTrue(all(a is b for a, b in zip(seen, seen[2:])))
+        self.assertEqual(camera.frame_id, 7)
+
+        # fps is measured over the last 3 frames: the stall drags it down
+        # until it leaves the window
+        self.assertGreater(fps[2], 50)
+        self.assertLess(fps[3], 10)
+        self.assertGreater(fps[6], 50)
+
+    def test_frame_source_is_abstract(self):
+
+        with self.assertRaises(TypeError):
+            FrameSource()
+
+
 def capture_test(i=300):
 
     camera = Camera()
@@ -0,0 +1,271 @@
+"""Single-pass lookup-table color classifier
+
+Every pixel of an 8-bit 3-channel image is one of 256^3 possible colors, so
+the result of thresholding against any number of ``cv2.inRange`` bounds can
+be precomputed once. The lookup table maps each color to a bitmask with one
+bit per color class; classifying a frame is then a single table lookup per
+pixel, and the mask for any class is a bit test on the label image.
+
+Usage
+-----
+classifier = ColorClassifier({
+    "field": (FIELD_LOWER, FIELD_UPPER),
+    "cube": (CUBE_LOWER, CUBE_UPPER)})
+labels = classifier.classify(hsv)
+cube_mask = classifier.mask(labels, "cube")
+
+YUV
+---
+Bounds are always given in HSV. With ``space="yuv"``, the HSV table is
+translated into a table indexed by (Y, U, V) instead, by running every YUV
+color through the same YUV420 -> BGR -> HSV conversion the frames would
+otherwise go through; frames can then be classified straight from the
+camera's YUV output.
+"""
+
+import hashlib
+import os
+import unittest
+
+import cv2
+import numpy as np
+
+
+def build_lut(bounds):
+    """Build a color lookup table
+
+    Parameters
+    ----------
+    bounds : (np.array, np.array)[]
+        Inclusive (lower, upper) channel bounds for each class, in bit order.
+        Class ``i`` is assigned bit ``1 << i``.
+
+    Returns
+    -------
+    np.array -- shape=(256, 256, 256), dtype=np.uint8
+        Lookup table indexed by (channel 0, channel 1, channel 2)
+    """
+
+    if len(bounds) > 8:
+        raise ValueError("At most 8 color classes fit in a uint8 label")
+
+    lut = np.zeros((256, 256, 256), dtype=np.uint8)
+    for idx, (lower, upper) in enumerate(bounds):
+        lower = np.clip(lower, 0, 255).astype(int)
+        upper = np.clip(upper, 0, 255).astype(int)
+        lut[
+            lower[0]:upper[0] + 1,
+            lower[1]:upper[1] + 1,
+            lower[2]:upper[2] + 1] |= (1 << idx)
+
+    return lut
+
+
+def yuv_lut(lut):
+    """Translate an HSV lookup table into a YUV lookup table
+
+    Parameters
+    ----------
+    lut : np.array -- shape=(256, 256, 256)
+        Lookup table indexed by (H, S, V)
+
+    Returns
+    -------
+    np.array -- shape=(256, 256, 256)
+        Lookup table indexed by (Y, U, V), where each YUV color is converted
+        with ``cv2.COLOR_YUV2BGR_I420`` and then ``cv2.COLOR_BGR2HSV``
+    """
+
+    # One 512x512 I420 image per Y value; each 2x2 block has its own (U, V)
+    # chroma sample, with U varying along rows and V along columns
+    i420 = np.empty((768, 512), dtype=np.uint8)
+    chroma = np.arange(256, dtype=np.uint8)
+    i420[512:640] = np.repeat(chroma, 256).reshape(128, 512)
+    i420[640:768] = np.tile(chroma, 256).reshape(128, 512)
+
+    out = np.empty_like(lut)
+    for y in range(256):
+        i420[:512] = y
+        bgr = cv2.cvtColor(i420, cv2.COLOR_YUV2BGR_I420)
+        hsv = cv2.cvtColor(
+            np.ascontiguousarray(bgr[::2, ::2]), cv2.COLOR_BGR2HSV)
+        out[y] = lut[hsv[:, :, 0], hsv[:, :, 1], hsv[:, :, 2]]
+
+    return out
+
+
+def _lut_key(bounds):
+    """Get a short digest identifying a set of class bounds"""
+
+    digest = hashlib.sha1()
+    for lower, upper in bounds:
+        digest.update(np.asarray(lower, dtype=np.int32).tobytes())
+        digest.update(np.asarray(upper, dtype=np.int32).tobytes())
+    return digest.hexdigest()[:12]
+
+
+class ColorClassifier:
+    """Lookup-table classifier for several color classes at once
+
+    Parameters
+    ----------
+    classes : dict
+        Ordered mapping of class name -> (lower, upper) bounds, with the same
+        semantics as ``cv2.inRange``. At most 8 classes are supported.
+    cache_dir : str or None
+        Directory to persist the YUV table in, as ``lut_yuv_<key>.npy``
+        where key is a digest of the bounds; changing any bound builds a new
+        table. If None, the table is built in memory on every startup. HSV
+        tables take a few milliseconds to build, and are never persisted.
+    space : str
+        Color space of the images to classify; "hsv" or "yuv". Bounds are
+        always given in HSV.
+
+    Attributes
+    ----------
+    classes : dict
+        Class name -> (lower, upper) HSV bounds
+    """
+
+    def __init__(self, classes, cache_dir=None, space="hsv"):
+
+        if space not in ["hsv", "yuv"]:
+            raise ValueError("Unknown color space '{}'".format(space))
+
+        self.classes = dict(classes)
+        self.names = list(classes.keys())
+        self.bits = {name: 1 << i for i, name in enumerate(self.names)}
+        self.space = space
+
+        bounds = [classes[name] for name in self.names]
+        self.lut = self.__load(bounds, cache_dir, space)
+        self.__flat = self.lut.reshape(-1)
+
+    @staticmethod
+    def __load(bounds, cache_dir, space):
+        """Build the lookup table; YUV tables are loaded from (and saved to)
+        the cache"""
+
+        if space == "hsv":
+            return build_lut(bounds)
+
+        def build():
+            return yuv_lut(build_lut(bounds))
+
+        if cache_dir is None:
+            return build()
+
+        path = os.path.join(cache_dir, "lut_yuv_{}.npy".format(
+            _lut_key(bounds)))
+        try:
+            lut = np.load(path)
+            if lut.shape == (256, 256, 256) and lut.dtype == np.uint8:
+                return lut
+        except (OSError, ValueError):
+            pass
+
+        lut = build()
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.save(path, lut)
+        except OSError:
+            # Read-only filesystem; use the in-memory table
+            pass
+        return lut
+
+    def classify(self, src, dst=None, work=None):
+        """Label every pixel with its class bitmask
+
+        Parameters
+        ----------
+        src : np.array -- shape=(HEIGHT, WIDTH, 3), dtype=np.uint8
+            Input image, in the color space the bounds were given in
+        dst : np.array or None -- shape=(HEIGHT, WIDTH), dtype=np.uint8
+            Output buffer; allocated if None
+        work : np.array or None -- shape=(HEIGHT, WIDTH), dtype=np.intp
+            Scratch buffer for the table indices; allocated if None
+
+        Returns
+        -------
+        np.array -- shape=(HEIGHT, WIDTH), dtype=np.uint8
+            Label image
+        """
+
+        if work is None:
+            work = np.empty(src.shape[:2], dtype=np.intp)
+        if dst is None:
+            dst = np.empty(src.shape[:2], dtype=np.uint8)
+
+        np.copyto(work, src[:, :, 0])
+        work <<= 8
+        work |= src[:, :, 1]
+        work <<= 8
+        work |= src[:, :, 2]
+
+        # Indices are always in range; 'clip' (unlike the default 'raise')
+        # writes straight into ``dst`` without a temporary copy
+        return np.take(self.__flat, work, out=dst, mode='clip')
+
+    def mask(self, labels, name, dst=None):
+        """Extract a single class mask from a label image
+
+        Parameters
+        ----------
+        labels : np.array
+            Label image returned by ``classify``
+        name : str
+            Class name
+        dst : np.array or None
+            Output buffer; allocated if None
+
+        Returns
+        -------
+        np.array
+            Mask with 255 where the pixel belongs to the class and 0 elsewhere,
+            identical to the corresponding ``cv2.inRange`` output
+        """
+
+        dst = cv2.bitwise_and(labels, self.bits[name], dst=dst)
+        return cv2.compare(dst, 0, cv2.CMP_NE, dst=dst)
+
+
+class Tests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+
+        from .vision import VisionModule
+        cls.hsv = VisionModule(lut_cache=None).classifier
+
+    def test_matches_in_range(self):
+
+        # Every HSV color, one V plane at a time
+        hsv = np.empty((256, 256, 3), dtype=np.uint8)
+        hsv[:, :, 0] = np.arange(256)[:, None]
+        hsv[:, :, 1] = np.arange(256)[None, :]
+        for v in range(256):
+            hsv[:, :, 2] = v
+            labels = self.hsv.classify(hsv)
+            for name, (lower, upper) in self.hsv.classes.items():
+                self.assertTrue(np.array_equal(
+                    self.hsv.mask(labels, name),
+                    cv2.inRange(hsv, lower, upper)), (name, v))
+
+    def test_yuv_matches_hsv(self):
+
+        from . import samples
+
+        yuv = ColorClassifier(self.hsv.classes, space="yuv")
+        for f in samples.FILES:
+            bgr = cv2.resize(
+                cv2.imread(os.path.join(samples.BASE_DIR, f)), (640, 480))
+            i420 = cv2.cvtColor(bgr, cv2.COLOR_BGR2YUV_I420)
+            expected = self.hsv.classify(cv2.cvtColor(
+                cv2.cvtColor(i420, cv2.COLOR_YUV2BGR_I420),
+                cv2.COLOR_BGR2HSV))
+
+            # (Y, U, V) per pixel; each 2x2 block shares its chroma sample
+            chroma = i420[480:].reshape(2, 240, 320)
+            packed = np.dstack([i420[:480]] + [
+                c.repeat(2, axis=0).repeat(2, axis=1) for c in chroma])
+            self.assertTrue(np.array_equal(yuv.classify(packed), expected))
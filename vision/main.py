@@ -1,5 +1,14 @@
 # from matplotlib import pyplot as plt
-from vision import VisionModule
+import os
+import sys
+import time
+
+# Import the vision package (not vision.py in this directory)
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from vision import ReplayCamera, VisionModule, VisionModuleThread
+from vision.objects import in_corridor, to_array
 import cv2
 import samples
 
@@ -34,19 +43,14 @@ def draw(img, objects):
             cv2.FONT_HERSHEY_PLAIN, 1.0, (255, 255, 255))
 
 
-def in_the_way(objs):
-
-    right = 0
-
-    for obj in objs:
-        if (
-                obj.dist > 0 and
-                obj.dist < 25 and
-                obj.rect[0] < 300 and
-                obj.rect[0] + obj.rect[2] > 340):
-            right = max(right, obj.rect[0] + obj.rect[2] - 320)
+def in_the_way(arr):
 
-    return right
+    # Objects closer than 25 spanning the middle of the frame; returns how
+    # far right of the center the rightmost of them extends, or 0
+    blocking = in_corridor(arr, 300, 340, max_dist=25, span=True)
+    if not len(blocking):
+        return 0
+    return int((blocking["rect"][:, 0] + blocking["rect"][:, 2]).max()) - 320
 
 
 def test(target, pause=True):
@@ -74,7 +78,7 @@ def test(target, pause=True):
 
         src = cv2.cvtColor(src, cv2.COLOR_BGR2RGB)
         draw(src, objects)
-        itw = in_the_way(objects)
+        itw = in_the_way(to_array(objects))
         if cvxhull is not None:
             cv2.drawContours(
                 src, [cvxhull], -1, (255, 255, 255), 3, cv2.LINE_8)
@@ -95,6 +99,57 @@ def test(target, pause=True):
     cv2.destroyAllWindows()
 
 
+def benchmark(target, workers=None):
+
+    mod = VisionModule(width=WIDTH, height=HEIGHT)
+    results, stats = mod.process_directory(target, workers=workers)
+
+    print("{} frames in {:.2f}s ({:.1f}fps, {} workers)".format(
+        stats.frames, stats.seconds, stats.fps, stats.workers))
+    for f in stats.skipped:
+        print("Skipped unreadable image {}".format(f))
+
+
+def replay(target, realtime=False, yuv=False, out_of_process=False):
+
+    camera = ReplayCamera(
+        target, fmt="yuv420" if yuv else None, realtime=realtime)
+    # Process every frame, unless replaying in real time
+    mod = VisionModuleThread(
+        camera=camera, drop=realtime, out_of_process=out_of_process)
+    mod.start()
+
+    start = time.time()
+    mod.capture = True
+    out = mod.get_output(timeout=None)
+    latency = []
+    while out:
+        latency.append(out.processed - out.timestamp)
+        if mod.finished and out.seq == mod.ring.published:
+            break
+        out = mod.wait_for_newer_than(out.seq, timeout=1)
+    total = time.time() - start
+    mod.stop()
+
+    print("{} of {} frames processed in {:.2f}s ({:.1f}fps)".format(
+        len(latency), mod.ring.published, total, len(latency) / total))
+    print("{} dropped".format(mod.ring.dropped))
+    print("latency: {:.1f}ms mean, {:.1f}ms max".format(
+        1000 * sum(latency) / len(latency), 1000 * max(latency)))
+
+
+def timing(target, out=None):
+
+    mod = VisionModule(width=WIDTH, height=HEIGHT)
+    mod.process_directory(target, workers=1)
+
+    for name, s in mod.timing.summary().items():
+        print("{:<20} {:>8.3f}ms p50 {:>8.3f}ms p90 {:>8.3f}ms max".format(
+            name, s["p50"] * 1000, s["p90"] * 1000, s["max"] * 1000))
+    if out is not None:
+        mod.timing.dump(out)
+
+
 if __name__ == '__main__':
     # import sys
     test('tests_02')
@@ -0,0 +1,216 @@
+"""Detected objects
+
+``Object`` is the detection result type returned by ``VisionModule``.
+``to_array`` / ``from_array`` convert lists of objects to and from a compact
+structured array (``OBJECT_DTYPE``), for recording and for passing results
+between processes without pickling objects. ``process(img, as_array=True)``
+returns this array directly.
+
+``of_class``, ``in_corridor`` and ``nearest`` are vectorized queries on
+object arrays.
+
+Usage
+-----
+arr = to_array(objects)
+arr["meta"] == b"cube"
+objects = from_array(arr)
+
+cubes = nearest(of_class(arr, "cube"), 3)
+blocking = in_corridor(arr, 300, 340, max_dist=25, span=True)
+"""
+
+import collections
+import math
+import unittest
+
+import numpy as np
+
+
+Object = collections.namedtuple(
+    "Object", ["rect", "dist", "meta", "bearing", "pos"])
+Object.__new__.__defaults__ = (None, None)
+Object.__doc__ = """Detected object
+
+rect is the bounding box [x, y, w, h]; dist the forward ground distance to
+its bottom edge (-1 or negative if not below the horizon); bearing the angle
+to its center (radians, positive to the left); pos its robot-relative (x, y)
+ground position, or None. See ``projection.Projection``.
+"""
+
+
+# Longest class name that is stored
+META_LENGTH = 8
+
+# Compact object record; a missing bearing is NaN, and a missing position
+# (NaN, NaN)
+OBJECT_DTYPE = np.dtype([
+    ("rect", "<i4", (4,)),
+    ("dist", "<f4"),
+    ("bearing", "<f4"),
+    ("pos", "<f4", (2,)),
+    ("meta", "S{}".format(META_LENGTH)),
+])
+
+
+def to_array(objects, out=None):
+    """Pack objects into a structured array
+
+    Parameters
+    ----------
+    objects : Object[]
+        Objects to pack; class names are truncated to ``META_LENGTH``
+    out : np.array or None
+        ``OBJECT_DTYPE`` array to write into (at least as long as
+        ``objects``); allocated if None
+
+    Returns
+    -------
+    np.array
+        ``OBJECT_DTYPE`` array of the objects (a view of ``out``, if given)
+    """
+
+    if out is None:
+        out = np.empty(len(objects), dtype=OBJECT_DTYPE)
+    out = out[:len(objects)]
+
+    nan = float("nan")
+    for i, o in enumerate(objects):
+        out[i] = (
+            o.rect, o.dist, nan if o.bearing is None else o.bearing,
+            (nan, nan) if o.pos is None else o.pos,
+            str(o.meta).encode()[:META_LENGTH])
+
+    return out
+
+
+def from_array(arr):
+    """Unpack a structured array (see ``to_array``) into objects"""
+
+    objects = []
+    for rect, dist, bearing, pos, meta in zip(
+            arr["rect"].tolist(), arr["dist"].tolist(),
+            arr["bearing"].tolist(), arr["pos"].tolist(),
+            arr["meta"].tolist()):
+        x, y = pos
+        objects.append(Object(
+            rect=list(rect), dist=dist, meta=meta.decode(),
+            bearing=None if math.isnan(bearing) else bearing,
+            pos=None if math.isnan(x) else (x, y)))
+
+    return objects
+
+
+def of_class(arr, *classes):
+    """Select the objects of the given classes
+
+    Parameters
+    ----------
+    arr : np.array
+        ``OBJECT_DTYPE`` array
+    *classes : str
+        Class names
+
+    Returns
+    -------
+    np.array
+        Objects of the given classes, in order
+    """
+
+    names = np.array(
+        [str(c).encode()[:META_LENGTH] for c in classes],
+        dtype=OBJECT_DTYPE["meta"])
+    return arr[np.isin(arr["meta"], names)]
+
+
+def in_corridor(arr, left, right, max_dist=None, span=False):
+    """Select the objects in a band of image columns (i.e. a corridor ahead
+    of the robot), below the horizon
+
+    Parameters
+    ----------
+    arr : np.array
+        ``OBJECT_DTYPE`` array
+    left : int
+        First column of the band
+    right : int
+        Last column of the band
+    max_dist : float or None
+        If set, only objects closer than this are selected
+    span : bool
+        If True, objects must extend past both sides of the band; otherwise,
+        any overlap with it is enough
+
+    Returns
+    -------
+    np.array
+        Selected objects, in order
+    """
+
+    x0 = arr["rect"][:, 0]
+    x1 = x0 + arr["rect"][:, 2]
+    dist = arr["dist"]
+
+    if span:
+        sel = (x0 < left) & (x1 > right)
+    else:
+        sel = (x0 <= right) & (x1 > left)
+    sel &= dist > 0
+    if max_dist is not None:
+        sel &= dist < max_dist
+
+    return arr[sel]
+
+
+def nearest(arr, count=1):
+    """Select the closest objects below the horizon
+
+    Parameters
+    ----------
+    arr : np.array
+        ``OBJECT_DTYPE`` array
+    count : int
+        Maximum number of objects to select
+
+    Returns
+    -------
+    np.array
+        Up to ``count`` objects, nearest first
+    """
+
+    arr = arr[arr["dist"] > 0]
+    return arr[np.argsort(arr["dist"], kind="stable")[:count]]
+
+
+class Tests(unittest.TestCase):
+
+    def test_round_trip(self):
+
+        objects = [
+            Object([1, 2, 3, 4], 10.5, "cube", 0.25, (10.5, 2.5)),
+            Object([5, 6, 7, 8], -1, "obstacle", -0.5, None),
+            Object([0, 0, 1, 1], 2.0, "green")]
+
+        arr = to_array(objects)
+        self.assertEqual(arr.dtype, OBJECT_DTYPE)
+        self.assertEqual((arr["meta"] == b"cube").tolist(),
+                         [True, False, False])
+        self.assertEqual(from_array(arr), objects)
+
+    def test_queries(self):
+
+        arr = to_array([
+            Object([280, 300, 80, 40], 20.0, "obstacle"),
+            Object([100, 300, 30, 30], 30.0, "cube"),
+            Object([310, 320, 20, 20], 10.0, "cube"),
+            Object([250, 100, 200, 40], -3.0, "green")])
+
+        self.assertEqual(of_class(arr, "cube")["dist"].tolist(), [30, 10])
+        self.assertEqual(len(of_class(arr, "cube", "green")), 3)
+        self.assertEqual(
+            in_corridor(arr, 300, 340)["dist"].tolist(), [20, 10])
+        self.assertEqual(
+            in_corridor(arr, 300, 340, span=True)["dist"].tolist(), [20])
+        self.assertEqual(
+            in_corridor(arr, 300, 340, max_dist=15)["dist"].tolist(), [10])
+        self.assertEqual(nearest(arr, 2)["dist"].tolist(), [10, 20])
+        self.assertEqual(len(nearest(arr[3:])), 0)
@@ -0,0 +1,226 @@
+"""Detection post-processing
+
+Candidate objects are filtered by per-class size rules, and objects whose
+horizontal extent lies inside an already accepted (wider) object are
+suppressed. Candidates are visited widest first; accepted objects are kept
+in a prefix-maximum tree over their left edges, so each containment query
+is a logarithmic sweep instead of a scan over all accepted objects.
+
+Usage
+-----
+post = PostProcessor({"base": ClassRule(max_w=100, min_h=50)}, isolate=5)
+final = post(objects)
+"""
+
+import collections
+import math
+import unittest
+
+import numpy as np
+
+
+ClassRule = collections.namedtuple(
+    "ClassRule", ["min_w", "max_w", "min_h", "max_h", "suppressible"])
+ClassRule.__new__.__defaults__ = (None, None, None, None, False)
+ClassRule.__doc__ = """Post-processing rule for an object class
+
+Bounds are exclusive; None is unbounded. If ``suppressible``, objects of the
+class are dropped when inside an accepted object; objects of every class can
+suppress others once accepted.
+"""
+
+
+# Markers must be wide enough; base stations narrow and tall; cubes and
+# obstacles are suppressed when inside another object. Sizes are in pixels
+# for 640px wide frames.
+DEFAULT_RULES = {
+    "yellow": ClassRule(min_w=25),
+    "blue": ClassRule(min_w=25),
+    "green": ClassRule(min_w=25),
+    "base": ClassRule(max_w=100, min_h=50),
+    "cube": ClassRule(suppressible=True),
+    "obstacle": ClassRule(suppressible=True),
+}
+
+# Rule for classes without one
+DEFAULT_RULE = ClassRule(suppressible=True)
+
+
+def scale_rules(rules, scale):
+    """Scale the size bounds of a set of rules
+
+    Parameters
+    ----------
+    rules : dict
+        class -> ClassRule
+    scale : float
+        Scale factor, i.e. image width / 640 for ``DEFAULT_RULES``
+
+    Returns
+    -------
+    dict
+        class -> ClassRule, with scaled bounds
+    """
+
+    def s(x):
+        return None if x is None else x * scale
+
+    return {
+        k: r._replace(
+            min_w=s(r.min_w), max_w=s(r.max_w),
+            min_h=s(r.min_h), max_h=s(r.max_h))
+        for k, r in rules.items()}
+
+
+class _MaxTree:
+    """Fenwick tree of prefix maxima over integer keys in [0, size)"""
+
+    def __init__(self, size):
+        self.size = size
+        self.tree = [-math.inf] * (size + 1)
+
+    def insert(self, key, value):
+        i = min(max(key, 0), self.size - 1) + 1
+        while i <= self.size:
+            if self.tree[i] < value:
+                self.tree[i] = value
+            i += i & -i
+
+    def query(self, key):
+        """Maximum value inserted at a key <= ``key``"""
+
+        i = min(key, self.size - 1) + 1
+        best = -math.inf
+        while i > 0:
+            if self.tree[i] > best:
+                best = self.tree[i]
+            i -= i & -i
+        return best
+
+
+class PostProcessor:
+    """Class-aware detection filter
+
+    Parameters
+    ----------
+    rules : dict or None
+        class -> ClassRule; overrides ``DEFAULT_RULES`` per class
+    isolate : float
+        Slack (in pixels) when checking whether one object is inside another
+    width : int
+        Image width; left edges are expected in [0, width)
+    default : ClassRule
+        Rule for classes without one
+    """
+
+    def __init__(self, rules=None, isolate=5, width=640, default=DEFAULT_RULE):
+
+        self.rules = dict(DEFAULT_RULES)
+        self.rules.update(rules or {})
+        self.isolate = isolate
+        self.width = width
+        self.default = default
+
+        self.__classes = {}
+        self.__bounds = np.zeros((0, 4))
+        self.__suppressible = np.zeros(0, dtype=bool)
+        for name in self.rules:
+            self.__class_index(name)
+
+    def __class_index(self, name):
+        """Get the row of a class in the rule arrays, adding it if needed"""
+
+        idx = self.__classes.get(name)
+        if idx is None:
+            rule = self.rules.get(name, self.default)
+            bounds = [
+                -math.inf if rule.min_w is None else rule.min_w,
+                math.inf if rule.max_w is None else rule.max_w,
+                -math.inf if rule.min_h is None else rule.min_h,
+                math.inf if rule.max_h is None else rule.max_h]
+            idx = self.__classes[name] = len(self.__classes)
+            self.__bounds = np.vstack([self.__bounds, bounds])
+            self.__suppressible = np.append(
+                self.__suppressible, rule.suppressible)
+        return idx
+
+    def __call__(self, objs):
+        """Filter objects
+
+        Parameters
+        ----------
+        objs : Object[]
+            Candidate objects
+
+        Returns
+        -------
+        Object[]
+            Accepted objects, widest first
+        """
+
+        if not objs:
+            return []
+
+        boxes = np.array([o.rect for o in objs], dtype=np.int64)
+        cls = np.array([self.__class_index(o.meta) for o in objs])
+        w, h = boxes[:, 2], boxes[:, 3]
+
+        # Size rules
+        b = self.__bounds[cls]
+        ok = (w > b[:, 0]) & (w < b[:, 1]) & (h > b[:, 2]) & (h < b[:, 3])
+
+        # Containment: r contains t if
+        #   r.x0 - isolate < t.x0  and  r.x1 + isolate > t.x1
+        # i.e. max(r.x1 | r.x0 <= query) > t.x1 - isolate
+        query = np.ceil(boxes[:, 0] + self.isolate).astype(np.int64) - 1
+        limit = boxes[:, 0] + w - self.isolate
+        suppressible = self.__suppressible[cls]
+
+        # Widest first; ties keep their input order
+        order = np.argsort(-w, kind='stable')
+        order = order[ok[order]]
+
+        tree = _MaxTree(self.width)
+        accepted = []
+        for i in order.tolist():
+            if suppressible[i] and query[i] >= 0 and (
+                    tree.query(int(query[i])) > limit[i]):
+                continue
+            tree.insert(int(boxes[i, 0]), int(boxes[i, 0] + w[i]))
+            accepted.append(objs[i])
+
+        return accepted
+
+
+class Tests(unittest.TestCase):
+
+    def test_matches_pairwise_filter(self):
+
+        Obj = collections.namedtuple("Obj", ["rect", "dist", "meta"])
+        rng = np.random.RandomState(0)
+        classes = ["cube", "obstacle", "green", "yellow", "base"]
+
+        def reference(objs, isolate=5):
+            final = []
+            objs = sorted(objs, key=lambda x: x.rect[2], reverse=True)
+            for x in objs:
+                if x.meta in ["yellow", "blue", "green"]:
+                    if x.rect[2] > 25:
+                        final.append(x)
+                elif x.meta in ["base"]:
+                    if x.rect[2] < 100 and x.rect[3] > 50:
+                        final.append(x)
+                elif not any(
+                        r.rect[0] - isolate < x.rect[0] and
+                        r.rect[0] + r.rect[2] + isolate >
+                        x.rect[0] + x.rect[2] for r in final):
+                    final.append(x)
+            return final
+
+        post = PostProcessor()
+        for _ in range(50):
+            objs = [
+                Obj([int(v) for v in rng.randint(0, 200, 4)], 0,
+                    classes[rng.randint(len(classes))])
+                for _ in range(rng.randint(0, 60))]
+            self.assertEqual(post(objs), reference(objs))
@@ -0,0 +1,173 @@
+"""Ground-plane projection
+
+Maps image pixels to positions on the field relative to the robot, assuming
+a flat field and a level camera at a known height. Viewing angles are taken
+to be proportional to the pixel offset from the image center (as in the
+original ``VisionModule`` distance estimate). All trigonometry is done once,
+at construction; lookups are table indexing only.
+
+Conventions
+-----------
+- dist : forward distance along the ground (same unit as the camera height);
+  negative at or above the horizon (where -1 marks the center row)
+- bearing : radians, 0 straight ahead, positive to the left
+- (x, y) : robot-relative ground position; x forward, y to the left
+
+Usage
+-----
+proj = Projection(640, 480, math.radians(63.54), math.radians(42.36), 6)
+dist, bearing, pos = proj.locate([x, y, w, h])
+"""
+
+import math
+import unittest
+
+import numpy as np
+
+
+class Projection:
+    """Precomputed camera projection tables
+
+    Parameters
+    ----------
+    width : int
+        Image width
+    height : int
+        Image height
+    fov_h : float
+        Horizontal field of view, in radians
+    fov_v : float
+        Vertical field of view, in radians
+    cam_height : float
+        Camera height above the field
+    field_map : bool
+        If True, also precompute per-pixel ground coordinates ``map_x`` and
+        ``map_y`` (float32 arrays of shape (height, width); NaN above the
+        horizon).
+
+    Attributes
+    ----------
+    dist : np.array -- shape=(height + 1,)
+        Forward distance of the bottom edge of each row; indexed by the
+        exclusive bottom ``y + h`` of a bounding box.
+    bearing : np.array -- shape=(2 * width + 1,)
+        Bearing of each half-pixel column; indexed by ``2 * x + w`` for the
+        center of a bounding box.
+    """
+
+    def __init__(
+            self, width, height, fov_h, fov_v, cam_height, field_map=False):
+
+        self.width = width
+        self.height = height
+
+        def row_dist(row):
+            try:
+                return cam_height / math.tan(
+                    fov_v * (row - height / 2) / height)
+            except ZeroDivisionError:
+                return -1
+
+        self.dist = np.array([row_dist(r) for r in range(height + 1)])
+        self.bearing = np.array([
+            -fov_h * (c / 2 - width / 2) / width
+            for c in range(2 * width + 1)])
+
+        # Lateral offset per unit of forward distance
+        self.lateral = np.tan(self.bearing)
+
+        # Plain lists are faster than numpy arrays for scalar lookups
+        self.__dist = self.dist.tolist()
+        self.__bearing = self.bearing.tolist()
+        self.__lateral = self.lateral.tolist()
+
+        self.map_x = None
+        self.map_y = None
+        if field_map:
+            self.__make_field_map()
+
+    def __make_field_map(self):
+        """Precompute ground coordinates for every pixel center"""
+
+        # Pixel centers are at half-pixel rows/columns; use the tables at the
+        # bottom edge of each row and the center of each column
+        fwd = self.dist[1:].astype(np.float32)
+        fwd[fwd <= 0] = np.nan
+        lateral = self.lateral[1::2].astype(np.float32)
+
+        self.map_x = np.repeat(fwd[:, None], self.width, axis=1)
+        self.map_y = self.map_x * lateral[None, :]
+
+    def locate(self, rect):
+        """Locate a bounding box on the field
+
+        Parameters
+        ----------
+        rect : [x, y, w, h]
+            Bounding box; its bottom center is taken as the ground contact
+            point.
+
+        Returns
+        -------
+        float
+            Forward distance
+        float
+            Bearing
+        (float, float) or None
+            Robot-relative (x, y) position; None if the box is not below the
+            horizon
+        """
+
+        x, y, w, h = rect
+        dist = self.__dist[y + h]
+        col = 2 * x + w
+
+        if dist > 0:
+            pos = (dist, dist * self.__lateral[col])
+        else:
+            pos = None
+        return dist, self.__bearing[col], pos
+
+    def ground(self, row, col):
+        """Robot-relative (x, y) ground position of a pixel
+
+        Returns None for pixels at or above the horizon.
+        """
+
+        if self.map_x is not None:
+            x = float(self.map_x[row, col])
+            return None if math.isnan(x) else (x, float(self.map_y[row, col]))
+
+        dist = self.__dist[row + 1]
+        if dist <= 0:
+            return None
+        return dist, dist * self.__lateral[2 * col + 1]
+
+
+class Tests(unittest.TestCase):
+
+    def test_matches_direct_computation(self):
+
+        fov_h, fov_v = math.radians(63.54), math.radians(42.36)
+        proj = Projection(640, 480, fov_h, fov_v, 6, field_map=True)
+
+        for x, y, w, h in [[0, 0, 10, 240], [100, 250, 55, 40],
+                           [600, 400, 40, 80], [300, 200, 40, 10]]:
+            try:
+                dist = 6 / math.tan(fov_v * ((y + h) - 240) / 480)
+            except ZeroDivisionError:
+                dist = -1
+            bearing = -fov_h * (x + w / 2 - 320) / 640
+
+            d, b, pos = proj.locate([x, y, w, h])
+            self.assertEqual(d, dist)
+            self.assertAlmostEqual(b, bearing)
+            if dist > 0:
+                self.assertAlmostEqual(pos[1], dist * math.tan(bearing))
+            else:
+                self.assertIsNone(pos)
+
+        self.assertIsNone(proj.ground(100, 100))
+        np.testing.assert_allclose(
+            proj.ground(400, 100), (proj.dist[401], proj.dist[401] *
+                                    proj.lateral[201]), rtol=1e-6)
@@ -0,0 +1,302 @@
+"""Match recorder
+
+Raw frames, with their detection results and timestamps, are recorded into
+a fixed-size ring file on a background thread, so that recording costs the
+control loop one frame copy and no encoding or disk I/O. The ring file is a
+memory-mapped ``.npy`` array of records (see ``record_dtype``); once full,
+the oldest records are overwritten.
+
+JPEG encoding is left to the offline export tool.
+
+Command Line Export
+-------------------
+python -m vision.recorder match.npy out
+-> writes out/<seq>.jpg (with detections drawn) and out/results.json
+
+Usage
+-----
+recorder = Recorder("match.npy", camera.shape, slots=64)
+
+objects, mask, cvxhull = mod.process(img)
+recorder.record(img, objects)
+
+recorder.close()
+"""
+
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import unittest
+
+import cv2
+import numpy as np
+
+from .objects import OBJECT_DTYPE, from_array, to_array
+
+
+COLORS = {
+    "obstacle": (255, 0, 0),
+    "cube": (0, 0, 255),
+    "green": (0, 255, 0),
+    "yellow": (255, 255, 0),
+    "base": (0, 255, 255)
+}
+
+
+def record_dtype(shape, max_objects=64):
+    """Record layout of a ring file
+
+    Parameters
+    ----------
+    shape : tuple
+        Frame shape; (H, W, 3) for BGR frames, or (H * 3 / 2, W) for I420
+    max_objects : int
+        Maximum number of objects stored per frame
+
+    Returns
+    -------
+    np.dtype
+        seq (0 for empty records), timestamp, objects (count and array),
+        and the raw frame
+    """
+
+    return np.dtype([
+        ("seq", "<i8"),
+        ("timestamp", "<f8"),
+        ("n_objects", "<i4"),
+        ("objects", OBJECT_DTYPE, (max_objects,)),
+        ("image", "u1", tuple(shape)),
+    ])
+
+
+class Recorder:
+    """Background recorder into a memory-mapped ring file
+
+    Parameters
+    ----------
+    path : str
+        Ring file to create (overwritten if it exists)
+    shape : tuple
+        Frame shape (see ``record_dtype``)
+    slots : int
+        Number of frames the ring file holds. The file is allocated up
+        front, with one raw frame per slot (900 KiB for 640x480 BGR), so
+        size this to the run.
+    max_objects : int
+        Maximum number of objects stored per frame; extra objects are
+        dropped
+    backlog : int
+        Number of frames that can wait for the writer thread. If the writer
+        falls behind, new frames are dropped (counted in ``dropped``) instead
+        of blocking the caller.
+
+    Attributes
+    ----------
+    recorded : int
+        Number of frames written to the ring file
+    dropped : int
+        Number of frames dropped because the writer was behind
+    """
+
+    def __init__(self, path, shape, slots=64, max_objects=64, backlog=4):
+
+        self.path = path
+        self.shape = tuple(shape)
+        self.max_objects = max_objects
+        self.recorded = 0
+        self.dropped = 0
+
+        self.__ring = np.lib.format.open_memmap(
+            path, mode="w+", dtype=record_dtype(shape, max_objects),
+            shape=(slots,))
+        self.__ring["seq"] = 0
+
+        # Staging buffers; record() copies into a free one, and the writer
+        # thread returns it once the frame is in the ring file
+        self.__free = queue.Queue()
+        for _ in range(backlog):
+            self.__free.put(np.empty(self.shape, dtype=np.uint8))
+        self.__pending = queue.Queue()
+        self.__seq = 0
+
+        self.__thread = threading.Thread(target=self.__write, daemon=True)
+        self.__thread.start()
+
+    def record(self, img, objects=(), timestamp=None, seq=None):
+        """Queue a frame for recording
+
+        Parameters
+        ----------
+        img : np.array
+            Frame, with shape ``shape``; copied before returning
+        objects : Object[]
+            Detection results for the frame
+        timestamp : float or None
+            Capture time; defaults to now
+        seq : int or None
+            Frame sequence number; defaults to counting recorded frames
+
+        Returns
+        -------
+        bool
+            False if the frame was dropped
+        """
+
+        if self.__thread is None:
+            raise ValueError("Recorder is closed")
+
+        try:
+            buf = self.__free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return False
+
+        np.copyto(buf, img)
+        self.__seq = self.__seq + 1 if seq is None else seq
+        self.__pending.put((
+            buf, self.__seq, time.time() if timestamp is None else timestamp,
+            list(objects)))
+        return True
+
+    def __write(self):
+        """Writer thread"""
+
+        while True:
+            item = self.__pending.get()
+            if item is None:
+                break
+            buf, seq, timestamp, objects = item
+
+            rec = self.__ring[self.recorded % self.__ring.shape[0]]
+            objects = objects[:self.max_objects]
+            rec["seq"] = seq
+            rec["timestamp"] = timestamp
+            rec["n_objects"] = len(objects)
+            to_array(objects, out=rec["objects"])
+            rec["image"] = buf
+            self.recorded += 1
+
+            self.__free.put(buf)
+
+    def close(self):
+        """Write out queued frames, and close the ring file"""
+
+        if self.__thread is None:
+            return
+        self.__pending.put(None)
+        self.__thread.join()
+        self.__thread = None
+        self.__ring.flush()
+        del self.__ring
+
+
+def load(path):
+    """Open a ring file
+
+    Records are read lazily from the memory-mapped file; index the ring
+    with the returned slot order to read them oldest first:
+
+    ring, order = load("match.npy")
+    for i in order:
+        rec = ring[i]
+
+    Returns
+    -------
+    np.memmap
+        All slots of the ring file (see ``record_dtype``), read only
+    np.array
+        Indices of the recorded (non-empty) slots, oldest first
+    """
+
+    ring = np.load(path, mmap_mode="r")
+    seq = np.array(ring["seq"])
+    order = np.argsort(seq, kind="stable")
+    return ring, order[seq[order] > 0]
+
+
+def export(path, out, draw=True):
+    """Export a ring file as JPEGs and a JSON file of results
+
+    Parameters
+    ----------
+    path : str
+        Ring file
+    out : str
+        Output directory; frames are written as ``<seq>.jpg`` and the
+        detections as ``results.json``
+    draw : bool
+        If True, detections are drawn on the exported frames
+    """
+
+    os.makedirs(out, exist_ok=True)
+
+    ring, order = load(path)
+    results = []
+    for i in order:
+        rec = ring[i]
+        img = rec["image"]
+        if img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_YUV2BGR_I420)
+        else:
+            img = img.copy()
+
+        objects = from_array(rec["objects"][:rec["n_objects"]])
+        if draw:
+            for o in objects:
+                x, y, w, h = o.rect
+                cv2.rectangle(
+                    img, (x, y), (x + w, y + h),
+                    COLORS.get(o.meta, (255, 255, 255)), 2)
+
+        seq = int(rec["seq"])
+        cv2.imwrite(os.path.join(out, "{}.jpg".format(seq)), img)
+        results.append({
+            "seq": seq, "timestamp": float(rec["timestamp"]),
+            "objects": [o._asdict() for o in objects]})
+
+    with open(os.path.join(out, "results.json"), "w") as f:
+        json.dump(results, f, indent=2)
+
+    return len(results)
+
+
+class Tests(unittest.TestCase):
+
+    def test_round_trip(self):
+
+        from .objects import Object
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "ring.npy")
+
+            # 5 frames into 3 slots: the first 2 are overwritten
+            rec = Recorder(
+                path, (4, 6, 3), slots=3, max_objects=2, backlog=5)
+            for seq in range(1, 6):
+                img = np.full((4, 6, 3), seq, dtype=np.uint8)
+                objects = [Object([seq, 0, 2, 2], seq / 2, "cube")] * seq
+                rec.record(img, objects, timestamp=seq * 0.1, seq=seq)
+            rec.close()
+            self.assertEqual((rec.recorded, rec.dropped), (5, 0))
+
+            ring, order = load(path)
+            self.assertIsInstance(ring, np.memmap)
+            self.assertEqual(ring["seq"][order].tolist(), [3, 4, 5])
+            for i, seq in zip(order, [3, 4, 5]):
+                self.assertEqual(ring[i]["timestamp"], seq * 0.1)
+                self.assertTrue((ring[i]["image"] == seq).all())
+                objects = from_array(
+                    ring[i]["objects"][:ring[i]["n_objects"]])
+                self.assertEqual(
+                    [(o.rect, o.meta) for o in objects],
+                    [([seq, 0, 2, 2], "cube")] * 2)
+            del ring
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) >= 3:
+        print("Exported {} frames".format(export(sys.argv[1], sys.argv[2])))
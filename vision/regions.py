@@ -0,0 +1,140 @@
+"""Rectangular image region helpers
+
+Regions are given as corner coordinates ``[x0, y0, x1, y1]`` (exclusive of
+``x1`` and ``y1``), so that ``img[y0:y1, x0:x1]`` is the region.
+"""
+
+import cv2
+import numpy as np
+
+
+def overlaps(a, b):
+    """Check if two regions overlap"""
+
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def expand(rect, r, bounds):
+    """Expand a region by ``r`` pixels on each side
+
+    Parameters
+    ----------
+    rect : [x0, y0, x1, y1]
+        Region to expand
+    r : int
+        Number of pixels to expand by
+    bounds : [x0, y0, x1, y1]
+        The expanded region is clipped to these bounds
+
+    Returns
+    -------
+    [x0, y0, x1, y1]
+        Expanded region
+    """
+
+    return [
+        max(bounds[0], rect[0] - r), max(bounds[1], rect[1] - r),
+        min(bounds[2], rect[2] + r), min(bounds[3], rect[3] + r)]
+
+
+def clip(rects, bounds):
+    """Clip regions to bounds, dropping regions that end up empty"""
+
+    clipped = []
+    for rect in rects:
+        rect = expand(rect, 0, bounds)
+        if rect[0] < rect[2] and rect[1] < rect[3]:
+            clipped.append(rect)
+    return clipped
+
+
+def merge_rects(rects):
+    """Merge overlapping rectangles
+
+    Parameters
+    ----------
+    rects : [[x0, y0, x1, y1], set][]
+        Rectangles (as corner coordinates), each tagged with a set of labels
+
+    Returns
+    -------
+    [[x0, y0, x1, y1], set][]
+        Non-overlapping rectangles covering the inputs; merged rectangles
+        carry the union of their labels.
+    """
+
+    merged = []
+    for rect, tags in rects:
+        rect, tags = list(rect), set(tags)
+        overlap = True
+        while overlap:
+            overlap = False
+            for other in merged:
+                o = other[0]
+                if overlaps(rect, o):
+                    rect = [
+                        min(rect[0], o[0]), min(rect[1], o[1]),
+                        max(rect[2], o[2]), max(rect[3], o[3])]
+                    tags |= other[1]
+                    merged.remove(other)
+                    overlap = True
+                    break
+        merged.append([rect, tags])
+
+    return merged
+
+
+def merge(rects):
+    """Merge overlapping untagged rectangles (see ``merge_rects``)"""
+
+    return [rect for rect, _ in merge_rects([(r, ()) for r in rects])]
+
+
+def dirty_rects(img, prev, tile, threshold, dst=None):
+    """Find the tiles of an image that changed
+
+    Parameters
+    ----------
+    img : np.array -- shape=(HEIGHT, WIDTH, 3)
+        New image
+    prev : np.array -- shape=(HEIGHT, WIDTH, 3)
+        Previous image
+    tile : int
+        Tile size, in pixels
+    threshold : int
+        A tile is dirty if any channel of any pixel differs by more than this
+    dst : np.array or None
+        Buffer for the absolute difference image; allocated if None
+
+    Returns
+    -------
+    [x0, y0, x1, y1][]
+        Dirty regions; horizontally adjacent dirty tiles are combined into a
+        single region.
+    """
+
+    height, width = img.shape[:2]
+    diff = cv2.absdiff(img, prev, dst=dst).reshape(height, -1)
+
+    # Maximum difference per tile (the last row/column of tiles may be
+    # smaller than the tile size)
+    channels = diff.shape[1] // width
+    tile_max = np.maximum.reduceat(
+        np.maximum.reduceat(diff, np.arange(0, height, tile), axis=0),
+        np.arange(0, diff.shape[1], tile * channels), axis=1)
+    dirty = tile_max > threshold
+
+    rects = []
+    for row, cols in enumerate(dirty):
+        y0, y1 = row * tile, min(height, (row + 1) * tile)
+        start = None
+        for col, d in enumerate(cols):
+            if d and start is None:
+                start = col
+            elif not d and start is not None:
+                rects.append([start * tile, y0, col * tile, y1])
+                start = None
+        if start is not None:
+            rects.append([start * tile, y0, width, y1])
+
+    return rects
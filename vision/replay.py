@@ -0,0 +1,175 @@
+"""Replay camera
+
+Streams recorded frames through the ``Camera`` interface, so that the full
+(threaded) vision stack can be run and benchmarked without camera hardware.
+
+Frames can be replayed from
+- a directory of images (in filename order),
+- an ``.npy`` stack of frames, shape (N, H, W, 3) for BGR or (N, H * 3 / 2,
+  W) for I420, or
+- a ``recorder.Recorder`` ring file,
+either at their original timing (recordings keep their timestamps; other
+sources are paced to ``framerate``) or as fast as possible.
+
+Usage
+-----
+camera = ReplayCamera("match.npy", realtime=False)
+for img in camera.stream():
+    objects, mask, cvxhull = mod.process(img, fmt=camera.fmt)
+print(camera.fps)
+"""
+
+import os
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from .camera import Camera, FrameSource
+from . import recorder
+from .samples import ALLOWED_EXTENSIONS
+
+
+class ReplaySource(FrameSource):
+    """``FrameSource`` serving a recording (see module docstring)
+
+    Parameters
+    ----------
+    path : str
+        Image directory, ``.npy`` frame stack, or recorder ring file
+    loop : bool
+        If True, the recording is replayed indefinitely
+    realtime : bool
+        If True, frames are replayed at their original timing; otherwise, as
+        fast as they are read
+    """
+
+    def __init__(self, path, loop=False, realtime=True):
+
+        super().__init__(realtime)
+        self.loop = loop
+        self.timestamps = None
+        self.order = None
+
+        if os.path.isdir(path):
+            self.files = [
+                os.path.join(path, f) for f in sorted(os.listdir(path))
+                if f.split('.')[-1] in ALLOWED_EXTENSIONS]
+            self.frames = None
+            self.native = 'bgr'
+            shape = cv2.imread(self.files[0]).shape if self.files else None
+        else:
+            self.files = None
+            data = np.load(path, mmap_mode="r")
+            if data.dtype.names and "image" in data.dtype.names:
+                # Frames stay memory-mapped; ``order`` maps replay
+                # positions to ring slots
+                data, self.order = recorder.load(path)
+                self.frames = data["image"]
+                self.timestamps = data["timestamp"][self.order].tolist()
+            else:
+                self.frames = data
+            self.native = 'yuv' if self.frames.ndim == 3 else 'bgr'
+            shape = self.frames.shape[1:] if len(self) else None
+
+        if shape is None:
+            raise ValueError("No frames in '{}'".format(path))
+        if self.native == 'yuv':
+            self.size = (shape[1], shape[0] * 2 // 3)
+        else:
+            self.size = (shape[1], shape[0])
+
+    def __len__(self):
+        if self.files is not None:
+            return len(self.files)
+        return len(self.frames if self.order is None else self.order)
+
+    def read(self, i, format):
+
+        if i >= len(self) and not self.loop:
+            raise EOFError("End of replay")
+        i %= len(self)
+
+        if self.files is not None:
+            img = cv2.imread(self.files[i])
+        elif self.order is not None:
+            img = self.frames[self.order[i]]
+        else:
+            img = self.frames[i]
+        timestamp = None if self.timestamps is None else self.timestamps[i]
+
+        return self.convert(img, self.native, format), timestamp
+
+
+class ReplayCamera(Camera):
+    """Camera replaying a recording
+
+    Has the ``Camera`` interface (``capture``, ``stream``, ``save``,
+    ``close``, ``fps``); ``capture`` raises ``EOFError`` and ``stream``
+    ends once the recording is exhausted (unless ``loop``).
+
+    Parameters
+    ----------
+    path : str
+        Image directory, ``.npy`` frame stack, or recorder ring file
+    fmt : str or None
+        Capture format ("bgr" or "yuv420"); defaults to the recording's
+    realtime : bool
+        If True, frames are replayed at their original timing; otherwise, as
+        fast as they are read
+    loop : bool
+        If True, the recording is replayed indefinitely
+    framerate : int
+        Replay rate for recordings without timestamps
+    fps_window : int
+        Number of recent frames ``fps`` is measured over
+    """
+
+    def __init__(
+            self, path, fmt=None, realtime=True, loop=False, framerate=30,
+            fps_window=30):
+
+        source = ReplaySource(path, loop=loop, realtime=realtime)
+        if fmt is None:
+            fmt = "yuv420" if source.native == 'yuv' else "bgr"
+
+        super().__init__(
+            fmt=fmt, framerate=framerate, source=source,
+            fps_window=fps_window, resolution=source.size)
+
+
+class Tests(unittest.TestCase):
+
+    def test_recording(self):
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "ring.npy")
+
+            # 5 frames into 3 slots: the ring wraps around
+            rec = recorder.Recorder(path, (48, 64, 3), slots=3, backlog=5)
+            for seq in range(1, 6):
+                img = np.full((48, 64, 3), seq, dtype=np.uint8)
+                rec.record(img, timestamp=seq * 0.1, seq=seq)
+            rec.close()
+
+            # Oldest first, with their timestamps
+            source = ReplaySource(path, realtime=False)
+            self.assertEqual(len(source), 3)
+            for i, seq in enumerate([3, 4, 5]):
+                img, timestamp = source.read(i, 'bgr')
+                self.assertTrue((img == seq).all())
+                self.assertEqual(timestamp, seq * 0.1)
+            with self.assertRaises(EOFError):
+                source.read(3, 'bgr')
+
+            # The stream ends with the recording; capture then fails
+            camera = ReplayCamera(path, realtime=False)
+            self.assertEqual(
+                [int(img[0, 0, 0]) for img in camera.stream()], [3, 4, 5])
+            with self.assertRaises(EOFError):
+                camera.capture()
+
+            looped = ReplaySource(path, loop=True, realtime=False)
+            self.assertEqual(looped.read(3, 'bgr')[1], 3 * 0.1)
+            del source, camera, looped
@@ -0,0 +1,189 @@
+"""Latest-frame ring buffer
+
+Connects a producer (camera capture) to a consumer (vision processing)
+running at different rates. Frames are written into preallocated slots; the
+consumer always gets the newest published frame, and frames published while
+the consumer was busy are dropped instead of queued, so results never lag
+more than one frame behind the camera.
+
+Usage
+-----
+ring = FrameRing((480, 640, 3))
+
+# producer
+idx, buf = ring.acquire()
+camera.capture(dst=buf)
+ring.publish(idx, time.time())
+
+# consumer
+frame = ring.take(timeout=0.1)
+if frame is not None:
+    process(frame.image)
+    ring.release(frame)
+"""
+
+import collections
+import threading
+import unittest
+
+import numpy as np
+
+
+RingFrame = collections.namedtuple(
+    "RingFrame", ["image", "seq", "timestamp", "slot"])
+
+
+class FrameRing:
+    """Newest-wins ring buffer of preallocated frames
+
+    Parameters
+    ----------
+    shape : tuple
+        Frame shape
+    dtype : np.dtype
+        Frame data type
+    slots : int
+        Number of frame slots; at least 3 (one being written, one published,
+        one being read), so that the producer never waits for the consumer.
+
+    Attributes
+    ----------
+    published : int
+        Number of frames published
+    dropped : int
+        Number of published frames that were replaced by a newer frame
+        before being taken
+    """
+
+    def __init__(self, shape, dtype=np.uint8, slots=3):
+
+        if slots < 3:
+            raise ValueError("FrameRing needs at least 3 slots")
+
+        self.buffers = [np.empty(shape, dtype=dtype) for _ in range(slots)]
+        self.published = 0
+        self.dropped = 0
+
+        self.__cond = threading.Condition()
+        self.__free = list(range(slots))
+        self.__latest = None
+        self.__meta = [None] * slots
+
+    def acquire(self):
+        """Get a free slot to write a frame into
+
+        Returns
+        -------
+        (int, np.array)
+            Slot index and its buffer
+        """
+
+        with self.__cond:
+            idx = self.__free.pop()
+        return idx, self.buffers[idx]
+
+    def publish(self, idx, timestamp):
+        """Publish a written slot as the newest frame
+
+        Parameters
+        ----------
+        idx : int
+            Slot index (from ``acquire``)
+        timestamp : float
+            Capture time of the frame
+
+        Returns
+        -------
+        int
+            Sequence number assigned to the frame
+        """
+
+        with self.__cond:
+            self.published += 1
+            self.__meta[idx] = (self.published, timestamp)
+            if self.__latest is not None:
+                self.__free.append(self.__latest)
+                self.dropped += 1
+            self.__latest = idx
+            self.__cond.notify_all()
+        return self.published
+
+    def take(self, timeout=None):
+        """Take the newest frame, waiting for one if none is pending
+
+        Parameters
+        ----------
+        timeout : float or None
+            Maximum time to wait, in seconds; waits indefinitely if None
+
+        Returns
+        -------
+        RingFrame or None
+            Newest frame, or None on timeout. The slot must be handed back
+            with ``release`` once the frame is no longer used.
+        """
+
+        with self.__cond:
+            if not self.__cond.wait_for(
+                    lambda: self.__latest is not None, timeout):
+                return None
+            idx, self.__latest = self.__latest, None
+            self.__cond.notify_all()
+
+        seq, timestamp = self.__meta[idx]
+        return RingFrame(
+            image=self.buffers[idx], seq=seq, timestamp=timestamp, slot=idx)
+
+    def wait_taken(self, timeout=None):
+        """Wait until the newest published frame has been taken
+
+        Lets a producer that must not drop frames wait for the consumer.
+
+        Returns
+        -------
+        bool
+            False on timeout
+        """
+
+        with self.__cond:
+            return self.__cond.wait_for(
+                lambda: self.__latest is None, timeout)
+
+    def release(self, frame):
+        """Return a taken frame's slot to the producer"""
+
+        with self.__cond:
+            self.__free.append(frame.slot)
+
+    def cancel(self, idx):
+        """Return an acquired slot without publishing it (i.e. when capture
+        into it failed)"""
+
+        with self.__cond:
+            self.__free.append(idx)
+
+
+class Tests(unittest.TestCase):
+
+    def test_newest_wins(self):
+
+        ring = FrameRing((2,), slots=3)
+        self.assertIsNone(ring.take(timeout=0))
+
+        for i in range(5):
+            idx, buf = ring.acquire()
+            buf[:] = i
+            ring.publish(idx, float(i))
+
+        frame = ring.take()
+        self.assertEqual((frame.seq, frame.timestamp), (5, 4.0))
+        self.assertEqual(frame.image.tolist(), [4, 4])
+        self.assertEqual(ring.dropped, 4)
+
+        # Producer keeps going while the frame is held
+        for i in range(5):
+            idx, buf = ring.acquire()
+            self.assertNotEqual(idx, frame.slot)
+            ring.publish(idx, 0.0)
+        ring.release(frame)
+        self.assertEqual(ring.take().seq, 10)
@@ -44,9 +44,22 @@ DBScan:
 - d=8              : ball density to use
 - option=single    : single or separate
 
+VisionModule:
+- main <dir> [-p]  : step through the images in a directory
+- batch <dir> [n]  : process a directory on n worker processes and report
+                     throughput
+- timing <dir> [out] : process a directory and report per-stage latencies;
+                     optionally dump them to a JSON file
+- replay <path> [-r] [-p] : run the threaded vision stack on a recording
+                     (image directory, .npy stack or recorder file), as
+                     fast as possible or (-r) at its original timing;
+                     (-p) runs the vision module in a worker process
+
 Examples
 --------
 python tester.py db_scan 1.png r=3 d=5
+python tester.py batch tests_02 4
+python tester.py timing tests_02 timing.json
 """
 
 
@@ -57,6 +70,19 @@ if __name__ == "__main__":
     elif sys.argv[1] == 'main':
         import main
         main.test(sys.argv[2], pause=len(sys.argv) > 3 and sys.argv[3] == '-p')
+    elif sys.argv[1] == 'batch':
+        import main
+        workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+        main.benchmark(sys.argv[2], workers=workers)
+    elif sys.argv[1] == 'replay':
+        import main
+        main.replay(
+            sys.argv[2], realtime='-r' in sys.argv[3:],
+            out_of_process='-p' in sys.argv[3:])
+    elif sys.argv[1] == 'timing':
+        import main
+        main.timing(
+            sys.argv[2], out=sys.argv[3] if len(sys.argv) > 3 else None)
     else:
         module, target = sys.argv[1:3]
         kwargs = {f.split("=")[0]: f.split("=")[1] for f in sys.argv[3:]}
@@ -0,0 +1,217 @@
+"""Per-stage latency instrumentation
+
+Each pipeline stage is timed with ``time.perf_counter`` into a rolling
+window of recent samples; statistics and histograms are computed from the
+window on request, so recording a sample is only a timer read and an array
+store.
+
+Usage
+-----
+timer = StageTimer()
+with timer.stage("field"):
+    ...
+
+print(timer.summary()["field"]["p90"])
+timer.dump("timing.json")
+"""
+
+import json
+import time
+import unittest
+
+import numpy as np
+
+
+# Histogram bin edges, in seconds: 10us to 1s, 4 bins per decade
+HISTOGRAM_EDGES = np.logspace(-5, 0, 21)
+
+
+class _Stage:
+    """Timer for a single stage; a context manager recording its duration"""
+
+    __slots__ = ["samples", "count", "start"]
+
+    def __init__(self, window):
+        self.samples = np.zeros(window)
+        self.count = 0
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.record(time.perf_counter() - self.start)
+
+    def record(self, seconds):
+        self.samples[self.count % self.samples.size] = seconds
+        self.count += 1
+
+    def window(self):
+        """Samples in the window, oldest first"""
+
+        n = self.samples.size
+        if self.count <= n:
+            return self.samples[:self.count].copy()
+        return np.roll(self.samples, -(self.count % n))
+
+
+class _NullStage:
+    """Stage timer that records nothing"""
+
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def record(self, seconds):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class StageTimer:
+    """Rolling per-stage latency statistics
+
+    Parameters
+    ----------
+    window : int
+        Number of recent samples kept per stage
+    enabled : bool
+        If False, nothing is recorded
+    """
+
+    def __init__(self, window=512, enabled=True):
+
+        self.window = window
+        self.enabled = enabled
+        self.__stages = {}
+
+    def stage(self, name):
+        """Get the timer for a stage, as a context manager
+
+        Stage timers are not reentrant; a stage must not be nested in
+        itself.
+        """
+
+        if not self.enabled:
+            return _NULL_STAGE
+
+        s = self.__stages.get(name)
+        if s is None:
+            s = self.__stages[name] = _Stage(self.window)
+        return s
+
+    def record(self, name, seconds):
+        """Record a sample for a stage timed elsewhere"""
+
+        self.stage(name).record(seconds)
+
+    @property
+    def stages(self):
+        """Names of the stages with samples, in order of first use"""
+
+        return [k for k, s in self.__stages.items() if s.count]
+
+    def samples(self, name):
+        """Samples (in seconds) in a stage's window, oldest first"""
+
+        s = self.__stages.get(name)
+        return np.zeros(0) if s is None else s.window()
+
+    def histogram(self, name, edges=HISTOGRAM_EDGES):
+        """Histogram of a stage's window
+
+        Parameters
+        ----------
+        name : str
+            Stage name
+        edges : np.array
+            Bin edges, in seconds; samples outside are clipped into the first
+            or last bin
+
+        Returns
+        -------
+        (np.array, np.array)
+            Counts per bin, bin edges
+        """
+
+        samples = np.clip(self.samples(name), edges[0], edges[-1])
+        counts, _ = np.histogram(samples, bins=edges)
+        return counts, edges
+
+    def summary(self):
+        """Statistics of every stage
+
+        Returns
+        -------
+        dict
+            stage -> {"count", "mean", "p50", "p90", "p99", "max",
+            "histogram": {"edges", "counts"}}; times are in seconds, and
+            "count" is the total number of samples recorded (statistics cover
+            the last ``window`` samples only).
+        """
+
+        out = {}
+        for name in self.stages:
+            samples = self.samples(name)
+            p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+            counts, edges = self.histogram(name)
+            out[name] = {
+                "count": self.__stages[name].count,
+                "mean": float(samples.mean()),
+                "p50": float(p50),
+                "p90": float(p90),
+                "p99": float(p99),
+                "max": float(samples.max()),
+                "histogram": {
+                    "edges": edges.tolist(), "counts": counts.tolist()},
+            }
+        return out
+
+    def dump(self, path=None):
+        """Dump ``summary`` as JSON
+
+        Parameters
+        ----------
+        path : str or None
+            File to write to; if None, the JSON string is returned
+        """
+
+        s = json.dumps(self.summary(), indent=2)
+        if path is None:
+            return s
+        with open(path, "w") as f:
+            f.write(s)
+
+    def reset(self):
+        """Drop all samples"""
+
+        self.__stages = {}
+
+
+class Tests(unittest.TestCase):
+
+    def test_rolling_window(self):
+
+        timer = StageTimer(window=4)
+        for i in range(6):
+            timer.record("a", i * 1e-3)
+        with timer.stage("b"):
+            pass
+
+        self.assertEqual(timer.stages, ["a", "b"])
+        self.assertEqual(
+            timer.samples("a").tolist(), [2e-3, 3e-3, 4e-3, 5e-3])
+
+        summary = json.loads(timer.dump())
+        self.assertEqual(summary["a"]["count"], 6)
+        self.assertEqual(summary["a"]["max"], 5e-3)
+        self.assertEqual(sum(summary["a"]["histogram"]["counts"]), 4)
+
+        self.assertEqual(StageTimer(enabled=False).stage("a").__enter__(),
+                         _NULL_STAGE)
@@ -0,0 +1,299 @@
+"""Multi-object tracker
+
+Assigns stable IDs to ``VisionModule`` detections across frames, smooths
+them with a constant-velocity alpha-beta filter per track, and predicts them
+between frames, so that control can get fresh estimates while vision runs at
+a lower frame rate.
+
+Each track filters its bounding box center and size, and its distance.
+Detections are associated with tracks of the same class greedily, in order
+of decreasing overlap (intersection over union) with the track's predicted
+box.
+
+Usage
+-----
+tracker = Tracker(projection=mod.projection)
+
+objects, mask, cvxhull = mod.process(img)
+tracks = tracker.update(objects, timestamp)
+
+# between frames
+tracks = tracker.predict(time.time())
+"""
+
+import collections
+import time
+import unittest
+
+import numpy as np
+
+
+Track = collections.namedtuple(
+    "Track", ["rect", "dist", "meta", "bearing", "pos", "id", "hits",
+              "missed"])
+Track.__doc__ = """Tracked object
+
+Has the ``Object`` fields (smoothed or predicted), plus the track id, the
+number of detections associated with the track, and the number of updates
+since its last detection.
+"""
+
+
+class _TrackState:
+    """Alpha-beta filter state of a track
+
+    ``x`` is (center x, center y, width, height, dist), ``v`` its rate of
+    change per second.
+    """
+
+    __slots__ = ["id", "meta", "x", "v", "t", "hits", "missed", "last"]
+
+    def __init__(self, id, obj, z, t):
+        self.id = id
+        self.meta = obj.meta
+        self.x = z
+        self.v = np.zeros_like(z)
+        self.t = t
+        self.hits = 1
+        self.missed = 0
+        self.last = obj
+
+    def predict(self, t):
+        return self.x + self.v * max(0.0, t - self.t)
+
+
+def _measure(obj):
+    """Filter measurement of an object"""
+
+    x, y, w, h = obj.rect
+    return np.array([x + w / 2, y + h / 2, w, h, obj.dist], dtype=float)
+
+
+def _iou(a, b):
+    """Intersection over union of two sets of (cx, cy, w, h) boxes
+
+    Returns
+    -------
+    np.array -- shape=(len(a), len(b))
+    """
+
+    a, b = a[:, None], b[None, :]
+    lo = np.maximum(a[..., :2] - a[..., 2:] / 2, b[..., :2] - b[..., 2:] / 2)
+    hi = np.minimum(a[..., :2] + a[..., 2:] / 2, b[..., :2] + b[..., 2:] / 2)
+    inter = np.prod(np.clip(hi - lo, 0, None), axis=2)
+    union = np.prod(a[..., 2:], axis=2) + np.prod(b[..., 2:], axis=2) - inter
+    return inter / np.maximum(union, 1e-9)
+
+
+class Tracker:
+    """Multi-object tracker
+
+    Parameters
+    ----------
+    alpha : float
+        Position gain of the alpha-beta filters, in (0, 1]; 1 follows the
+        detections exactly
+    beta : float
+        Velocity gain of the alpha-beta filters; 0 disables velocity
+        estimation
+    min_iou : float
+        Minimum overlap between a track's predicted box and a detection for
+        them to be associated
+    max_missed : int
+        Number of consecutive updates a track survives without detections;
+        meanwhile, it is reported at its predicted position
+    min_hits : int
+        Number of detections before a track is reported
+    projection : projection.Projection or None
+        Used to recompute the bearing and position of smoothed and predicted
+        boxes (i.e. ``VisionModule.projection``); if None, tracks report the
+        bearing and position of their last detection.
+    """
+
+    def __init__(self, alpha=0.6, beta=0.2, min_iou=0.2, max_missed=3,
+                 min_hits=1, projection=None):
+
+        self.alpha = alpha
+        self.beta = beta
+        self.min_iou = min_iou
+        self.max_missed = max_missed
+        self.min_hits = min_hits
+        self.projection = projection
+
+        self.__tracks = []
+        self.__next_id = 1
+
+    def __associate(self, tracks, measurements, t):
+        """Greedily match tracks to measurements of the same class
+
+        Returns
+        -------
+        (int, int)[]
+            (track index, measurement index) pairs
+        """
+
+        if not tracks or not measurements:
+            return []
+
+        pred = np.array([s.predict(t)[:4] for s in tracks])
+        meas = np.array([z[:4] for _, z in measurements])
+        overlap = _iou(pred, meas)
+
+        # Only tracks and detections of the same class can match
+        same = (np.array([s.meta for s in tracks], dtype=object)[:, None] ==
+                np.array([o.meta for o, _ in measurements],
+                         dtype=object)[None, :])
+        overlap[~same] = 0
+
+        pairs = []
+        used_t, used_m = set(), set()
+        order = np.argsort(-overlap, axis=None, kind="stable")
+        for i, j in zip(*np.unravel_index(order, overlap.shape)):
+            if overlap[i, j] < self.min_iou:
+                break
+            if i in used_t or j in used_m:
+                continue
+            used_t.add(i)
+            used_m.add(j)
+            pairs.append((int(i), int(j)))
+
+        return pairs
+
+    def update(self, objects, timestamp=None):
+        """Update the tracks with the detections of a frame
+
+        Parameters
+        ----------
+        objects : Object[]
+            Detections (``VisionModule.process`` output)
+        timestamp : float or None
+            Capture time of the frame, in seconds; defaults to now
+
+        Returns
+        -------
+        Track[]
+            Current tracks (see ``tracks``)
+        """
+
+        t = time.time() if timestamp is None else timestamp
+        measurements = [(o, _measure(o)) for o in objects]
+
+        updated, matched = set(), set()
+        for i, j in self.__associate(self.__tracks, measurements, t):
+            state = self.__tracks[i]
+            obj, z = measurements[j]
+            dt = t - state.t
+            pred = state.predict(t)
+
+            r = z - pred
+            state.x = pred + self.alpha * r
+            if dt > 0:
+                state.v = state.v + self.beta * r / dt
+
+            # Distance is only filtered below the horizon
+            if z[4] <= 0 or pred[4] <= 0:
+                state.x[4] = z[4]
+                state.v[4] = 0
+
+            state.t = t
+            state.hits += 1
+            state.missed = 0
+            state.last = obj
+            updated.add(i)
+            matched.add(j)
+
+        live = []
+        for i, state in enumerate(self.__tracks):
+            if i not in updated:
+                state.missed += 1
+            if state.missed <= self.max_missed:
+                live.append(state)
+
+        for j, (obj, z) in enumerate(measurements):
+            if j not in matched:
+                live.append(_TrackState(self.__next_id, obj, z, t))
+                self.__next_id += 1
+
+        self.__tracks = live
+        return self.tracks(t)
+
+    def tracks(self, timestamp=None):
+        """Get the current tracks
+
+        Parameters
+        ----------
+        timestamp : float or None
+            Time to report the tracks at; tracks are extrapolated from their
+            last update. Defaults to the time of the last update.
+
+        Returns
+        -------
+        Track[]
+            Tracks with at least ``min_hits`` detections
+        """
+
+        return [
+            self.__report(s, s.t if timestamp is None else timestamp)
+            for s in self.__tracks if s.hits >= self.min_hits]
+
+    def predict(self, timestamp=None):
+        """Get the tracks predicted at a time (by default, now)"""
+
+        return self.tracks(time.time() if timestamp is None else timestamp)
+
+    def reset(self):
+        """Drop all tracks"""
+
+        self.__tracks = []
+
+    def __report(self, state, t):
+        """Build the ``Track`` of a track state at time ``t``"""
+
+        cx, cy, w, h, dist = state.predict(t).tolist()
+        w, h = max(1, int(round(w))), max(1, int(round(h)))
+        rect = [int(round(cx - w / 2)), int(round(cy - h / 2)), w, h]
+
+        if self.projection is None:
+            bearing, pos = state.last.bearing, state.last.pos
+        else:
+            # Bearing of the box center (see ``Projection.locate``); boxes
+            # predicted past the image edge take the edge bearing
+            col = min(max(2 * rect[0] + w, 0), 2 * self.projection.width)
+            bearing = float(self.projection.bearing[col])
+            pos = None
+            if dist > 0:
+                pos = (dist, dist * float(self.projection.lateral[col]))
+
+        return Track(
+            rect=rect, dist=dist, meta=state.meta, bearing=bearing, pos=pos,
+            id=state.id, hits=state.hits, missed=state.missed)
+
+
+class Tests(unittest.TestCase):
+
+    def test_tracks_moving_object(self):
+
+        from .objects import Object
+
+        tracker = Tracker(alpha=0.5, beta=0.5, max_missed=1)
+        for i in range(10):
+            tracks = tracker.update([
+                Object([100 + 10 * i, 300, 40, 40], 20 - i, "cube"),
+                Object([400, 100, 60, 20], -5, "green")], timestamp=i)
+            self.assertEqual(
+                sorted((t.meta, t.id) for t in tracks),
+                [("cube", 1), ("green", 2)])
+
+        # Constant velocity is learned, and extrapolated between frames
+        cube = [t for t in tracker.predict(9.5) if t.meta == "cube"][0]
+        self.assertAlmostEqual(cube.rect[0], 195, delta=2)
+        self.assertAlmostEqual(cube.dist, 10.5, delta=0.5)
+
+        # Tracks coast for ``max_missed`` updates, then are dropped
+        self.assertEqual(len(tracker.update([], timestamp=10)), 2)
+        self.assertEqual(tracker.update([], timestamp=11), [])
+
+        # A different class at the same place starts a new track
+        tracks = tracker.update(
+            [Object([400, 100, 60, 20], -5, "yellow")], timestamp=12)
+        self.assertEqual([t.id for t in tracks], [3])
@@ -9,24 +9,97 @@ Initialize the vision module with ``VisionModule()``. Call the
 import cv2
 import numpy as np
 import math
+import os
+import unittest
+from concurrent.futures import ThreadPoolExecutor
 
+from . import batch
+from . import regions
+from .buffers import BufferPool
+from .classify import ColorClassifier
+from .postprocess import DEFAULT_RULES, PostProcessor, scale_rules
+from .projection import Projection
+from .timing import StageTimer
+from .objects import Object, to_array
 
-import collections
-Object = collections.namedtuple("Object", ["rect", "dist", "meta"])
 
+def _find_contours(mask, offset=(0, 0)):
+    """Find the outer contours of a mask
 
-def _find_contours(mask):
-    """Helper function to deal with OpenCV version changes in the findContours
-    API, because fuck opencv, you assholes"""
+    ``offset`` is added to every contour point, so that contours found in a
+    sub-image are returned in full-frame coordinates."""
 
-    if cv2.__version__ == '4.0.0':
-        contours, hier = cv2.findContours(
-            mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
-    else:
-        _, contours, hier = cv2.findContours(
-            mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    # OpenCV 3 returns (image, contours, hierarchy) and OpenCV 4 (contours,
+    # hierarchy); the contours are second to last in both
+    return cv2.findContours(
+        mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE, offset=offset)[-2]
 
-    return contours
+
+def _find_components(mask, labels, offset=(0, 0)):
+    """Find the 8-connected components of a mask
+
+    Parameters
+    ----------
+    mask : np.array
+        Input mask
+    labels : np.array
+        int32 buffer of the shape of ``mask``, for the component labels
+    offset : (int, int)
+        Added to the bounding boxes and centroids (see ``_find_contours``)
+
+    Returns
+    -------
+    np.array
+        (N, 4) int32 array of bounding boxes [x, y, w, h]
+    np.array
+        (N,) int32 array of areas, in pixels
+    np.array
+        (N, 2) float64 array of centroids (x, y)
+    """
+
+    n, _, stats, centroids = cv2.connectedComponentsWithStatsWithAlgorithm(
+        mask, 8, cv2.CV_32S, cv2.CCL_GRANA, labels=labels)
+
+    # Component 0 is the background
+    rects = stats[1:n, :4].copy()
+    rects[:, :2] += offset
+    centroids = centroids[1:n] + offset
+
+    return rects, stats[1:n, cv2.CC_STAT_AREA], centroids
+
+
+def _morph(src, ops, dst, tmp):
+    """Apply a chain of erosions and dilations to a mask
+
+    Parameters
+    ----------
+    src : np.array
+        Input mask
+    ops : [(function, np.array)]
+        ``cv2.erode`` or ``cv2.dilate``, and kernel, for each step
+    dst : np.array
+        Output buffer; may be ``src``
+    tmp : np.array
+        Scratch buffer for intermediate steps; may be ``src``
+
+    Returns
+    -------
+    np.array
+        ``dst``, holding the filtered mask
+    """
+
+    # Erosion and dilation (with their default, neutral borders) map an
+    # empty mask to an empty mask; marker masks are empty in most frames
+    if not cv2.countNonZero(src):
+        dst[...] = 0
+        return dst
+
+    # Alternate between the buffers so that the last step writes ``dst``
+    for i, (op, kernel) in enumerate(ops):
+        out = dst if (len(ops) - i) % 2 else tmp
+        src = op(src, kernel, dst=out)
+
+    return src
 
 
 class VisionModule():
@@ -43,6 +116,86 @@ class VisionModule():
         Erosion kernel size, as a fraction of the image width.
     dilate_ksize : float
         Dilation kernel size, as a fraction of the image width.
+    isolate : float
+        Slack (in pixels) when suppressing objects inside other objects.
+    rules : dict or None
+        Post-processing rules (object class -> ``postprocess.ClassRule``),
+        overriding the defaults per class.
+    lut_cache : str or None
+        Directory to persist the YUV color lookup table in (see
+        ``classify.ColorClassifier``). If None, the table is rebuilt on
+        startup.
+    horizon : int or None
+        Image row of the horizon for this camera mount; defaults to
+        ``HORIZON``. The field, cubes and obstacles are only searched for
+        below the horizon, and the green and yellow markers above it; each
+        stage only processes its side of the frame.
+    cascade : int or None
+        If set, run in coarse-to-fine mode: the frame is first processed
+        downscaled by this factor (i.e. 4 -> 160x120) to find candidate
+        objects, and only the regions around candidates are re-processed at
+        full resolution. The union of the regions is classified once into
+        full-frame buffers shared by all candidates, and each candidate only
+        runs the stages of its class. The regions refined in the last frame
+        are stored in ``refined`` as ``([x, y, w, h], classes)`` pairs. On
+        the 640x480 samples, they cover 2-14% of the frame, and a frame
+        takes about 0.6x (``cascade=4``) to 0.65x (``cascade=8``) the time
+        of full-frame processing, most of it in the coarse pass.
+    incremental : bool
+        If True, run in incremental mode for mostly static scenes: each frame
+        is compared to the previous one on a grid of ``tile`` x ``tile``
+        tiles, and only the regions around tiles that changed by more than
+        ``tile_threshold`` (in any channel of any pixel) are re-processed.
+        Masks and objects of unchanged regions are reused. The regions
+        re-processed in the last frame are stored in ``dirty``. Cannot be
+        combined with ``cascade``.
+    classifier : ColorClassifier or None
+        Color classifier to share with another module using the same color
+        bounds; if None, one is built (or loaded from ``lut_cache``).
+    color : str
+        Color space frames are classified in. "hsv" (default) converts each
+        frame to HSV. "yuv" classifies YUV frames directly, with a lookup
+        table translated from the HSV bounds; use with ``fmt="yuv420"``
+        input to skip both the camera's RGB conversion and ``cvtColor``.
+    field_map : bool
+        If True, also precompute a per-pixel ground coordinate map
+        (``projection.map_x``, ``projection.map_y``).
+    threads : int or None
+        If set, run in parallel mode: the frame is split into this many
+        horizontal strips, which are classified and filtered (erode/dilate)
+        on a pool of threads. Strips overlap by the reach of the filters,
+        so results are identical to sequential processing. Cannot be
+        combined with ``cascade`` or ``incremental``.
+    timing : bool
+        If True (default), record per-stage latencies in ``timing`` (a
+        ``StageTimer``): "input", "color" (HSV conversion), "classify",
+        "field", "hull", "hull_check" (see ``hull_refresh``), "field_mask",
+        "mask.<class>", "contours.<class>", "postprocess" and "total", plus
+        "coarse" for the whole coarse pass in cascade mode. Samples are per
+        call, so a stage may be recorded several times per frame in cascade
+        and incremental modes. In parallel mode, the strip stages are timed
+        as a whole, as "classify", "mask.markers", "field" and
+        "mask.objects".
+    extraction : str
+        How objects are extracted from the class masks. "contours" (default)
+        traces the outer contour of each blob, and ignores blobs inside the
+        holes of other blobs. "components" labels connected components
+        instead (``cv2.connectedComponentsWithStats``), which yields bounding
+        boxes without storing boundary points, but reports nested blobs as
+        well; it is the faster choice for dense masks, and slower for the
+        sparse masks of a typical field.
+    hull_refresh : int or None
+        If set, the field convex hull is cached across frames, and only
+        recomputed every ``hull_refresh`` frames, when more than
+        ``hull_tolerance`` of the field pixels fall outside the cached hull
+        or the field area changes by more than ``hull_tolerance``, or after
+        ``invalidate_hull`` (i.e. when the robot moves). Not used in
+        incremental mode, which tracks the hull itself.
+    hull_tolerance : float
+        Tolerance of the cached hull check, as a fraction of the field area
+
+    All intermediate images are written into buffers preallocated for
+    (width, height) frames, so processing does not allocate image memory.
     """
 
     FOV_H = math.radians(63.54)
@@ -69,10 +222,50 @@ class VisionModule():
 
     HORIZON = 240
 
+    # Maximum number of times a cascade region is grown to contain the
+    # objects extending past it (see ``cascade``)
+    CASCADE_GROW = 2
+
+    # Outputs ``process`` can be restricted to (see ``want``), and the
+    # stages each one depends on, in evaluation order: cubes are found
+    # inside the field mask, and obstacles outside the cube mask
+    STAGES = {
+        "field": ["field"],
+        "cube": ["field", "cube"],
+        "obstacle": ["field", "cube", "obstacle"],
+        "yellow": ["yellow"],
+        "green": ["green"],
+        "base": ["base"],
+    }
+
+    LUT_CACHE = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), "lut")
+
     def __init__(
             self, width=640, height=480,
             erode_ksize=0.025, dilate_ksize=0.020, cube_ksize=0.04,
-            isolate=5):
+            isolate=5, lut_cache=LUT_CACHE, horizon=None, cascade=None,
+            classifier=None, incremental=False, tile=32, tile_threshold=20,
+            rules=None, color="hsv", field_map=False, threads=None,
+            timing=True, extraction="contours", hull_refresh=None,
+            hull_tolerance=0.02):
+
+        # Constructor arguments, to build identical modules in other
+        # processes (the classifier is rebuilt from ``lut_cache``)
+        self.options = dict(
+            width=width, height=height, erode_ksize=erode_ksize,
+            dilate_ksize=dilate_ksize, cube_ksize=cube_ksize,
+            isolate=isolate, lut_cache=lut_cache, horizon=horizon,
+            cascade=cascade, incremental=incremental, tile=tile,
+            tile_threshold=tile_threshold, rules=rules, color=color,
+            field_map=field_map, threads=threads, timing=timing,
+            extraction=extraction, hull_refresh=hull_refresh,
+            hull_tolerance=hull_tolerance)
+
+        if extraction not in ["contours", "components"]:
+            raise ValueError(
+                "Unknown extraction method '{}'".format(extraction))
+        self.extraction = extraction
 
         self.erode_ksize = int(erode_ksize * width)
         self.dilate_ksize = int(dilate_ksize * width)
@@ -80,6 +273,8 @@ class VisionModule():
         self.width = width
         self.height = height
         self.isolate = isolate
+        self.color = color
+        self.horizon = self.HORIZON if horizon is None else horizon
 
         def make_square_kernel(i):
             return np.ones((i, i), np.uint8)
@@ -88,12 +283,185 @@ class VisionModule():
         self.__dilate_mask = make_square_kernel(self.dilate_ksize)
         self.__cube_erode_mask = make_square_kernel(self.erode_ksize)
 
+        # Morphology chains (see ``_morph``)
+        self.__marker_ops = [(cv2.dilate, self.__dilate_mask)]
+        self.__open_ops = [
+            (cv2.erode, self.__erode_mask), (cv2.dilate, self.__dilate_mask)]
+        self.__cube_ops = [
+            (cv2.dilate, self.__dilate_mask),
+            (cv2.erode, self.__cube_erode_mask),
+            (cv2.dilate, self.__dilate_mask)]
+
+        # Regions of interest on each side of the horizon. Each is padded by
+        # enough rows to cover the reach of the longest erode/dilate chain,
+        # so that kernel borders behave exactly as on the full frame.
+        self.__halo = 2 * self.erode_ksize + 3 * self.dilate_ksize
+        self.__below = max(0, self.horizon + 1 - self.__halo)
+        self.__above = min(self.height, self.horizon + self.__halo)
+
+        # Label image rows read by each stage
+        self.__stage_rows = {
+            "field": (self.__below, self.height),
+            "cube": (self.__below, self.height),
+            "obstacle": (self.__below, self.height),
+            "yellow": (0, self.__above),
+            "green": (0, self.__above),
+            "base": (0, self.height),
+        }
+
+        # Field hull cached across frames; its filled image is kept in the
+        # "hull" buffer
+        self.hull_refresh = hull_refresh
+        self.hull_tolerance = hull_tolerance
+        self.__hull = None
+        self.__hull_age = 0
+        self.__hull_area = 0
+
+        # Pixel size thresholds are tuned for 640px wide frames
+        self.__px = width / 640
+
+        # Per-stage latencies
+        self.timing = StageTimer(enabled=timing)
+
+        # Distance / bearing lookup tables
+        self.projection = Projection(
+            width, height, self.FOV_H, self.FOV_V, self.CAM_HEIGHT,
+            field_map=field_map)
+
+        # Class-aware filtering of candidate objects
+        self.postprocess = PostProcessor(
+            dict(scale_rules(DEFAULT_RULES, self.__px), **(rules or {})),
+            isolate=isolate, width=width)
+
+        # All color classes are labeled in a single lookup per pixel
+        if classifier is not None:
+            self.classifier = classifier
+        else:
+            self.classifier = self.__make_classifier(lut_cache)
+
+        # Preallocated intermediate images; see ``BufferPool`` for naming
+        size = width * height
+        self.__pool = BufferPool()
+        self.__pool.reserve("input", size * 3)
+        if color == "yuv":
+            for name in ["i420", "chroma_u", "chroma_v"]:
+                self.__pool.reserve(name, size * 3 // 2)
+        self.__pool.reserve("hsv", size * 3)
+        self.__pool.reserve("index", size * np.dtype(np.intp).itemsize)
+        self.__pool.reserve("diff", size * 3)
+        for name in ["labels", "mask", "field", "hull", "marker", "cube",
+                     "obstacle", "tmp", "upscaled"]:
+            self.__pool.reserve(name, size)
+        if extraction == "components":
+            self.__pool.reserve("components", size * 4)
+
+        # Coarse pass module for cascade mode
+        self.cascade = cascade
+        self.refined = []
+        self.__coarse = None
+        self.__cascade_pad = (cascade or 1) + self.dilate_ksize
+        if cascade:
+            self.__pool.reserve("uncovered", size)
+            self.__coarse = VisionModule(
+                width=width // cascade, height=height // cascade,
+                erode_ksize=erode_ksize, dilate_ksize=dilate_ksize,
+                cube_ksize=cube_ksize, isolate=isolate,
+                horizon=self.horizon // cascade, classifier=self.classifier,
+                color=color, timing=False, extraction=extraction)
+
+        # Persistent images and objects for incremental mode
+        if sum(bool(m) for m in [cascade, incremental, threads]) > 1:
+            raise ValueError(
+                "Cascade, incremental and parallel modes are exclusive")
+        self.incremental = incremental
+        self.tile = tile
+        self.tile_threshold = tile_threshold
+        self.dirty = []
+        self.__state = BufferPool()
+        self.__cache = None
+        if incremental:
+            self.__state.reserve("prev", size * 3)
+            for name in ["labels", "mask", "field", "hull", "green",
+                         "yellow", "base", "cube", "obstacle"]:
+                self.__state.reserve(name, size)
+
+        # Strip modules for parallel mode; each has its own buffers, sized
+        # for a strip and its padding, and writes its part of the full-frame
+        # stage outputs (kept in ``__state``)
+        self.threads = threads
+        self.__strips = []
+        self.__executor = None
+        if threads:
+            rows = min(height, -(-height // threads) + 2 * self.__halo)
+            self.__strips = [
+                VisionModule(
+                    width=width, height=rows, erode_ksize=erode_ksize,
+                    dilate_ksize=dilate_ksize, cube_ksize=cube_ksize,
+                    classifier=self.classifier, color=color, timing=False)
+                for _ in range(threads)]
+            self.__executor = ThreadPoolExecutor(max_workers=threads)
+            for name in ["labels", "field", "green", "yellow", "base",
+                         "cube", "obstacle"]:
+                self.__state.reserve(name, size)
+
+    def __make_classifier(self, lut_cache):
+        """Build the color classifier from the class color bounds"""
+
+        return ColorClassifier({
+            "field": (self.FIELD_LOWER, self.FIELD_UPPER),
+            "cube": (self.CUBE_LOWER, self.CUBE_UPPER),
+            "base": (self.BASE_STATION_LOWER, self.BASE_STATION_UPPER),
+            "light": (self.LIGHT_LOWER, self.LIGHT_UPPER),
+            "green": (self.GREEN_LOWER, self.GREEN_UPPER),
+            "yellow": (self.YELLOW_LOWER, self.YELLOW_UPPER),
+        }, cache_dir=lut_cache, space=self.color)
+
     def __below_horizon(self, contour):
 
         x, y, w, h = cv2.boundingRect(contour)
-        return y + h > self.HORIZON and w > 100 and h > 50
+        return (
+            y + h > self.horizon and
+            w > 100 * self.__px and h > 50 * self.__px)
+
+    def __clean_field(self, labels):
+        """Threshold the field color, then erode and dilate"""
+
+        with self.timing.stage("field"):
+            mask = self.classifier.mask(
+                labels, "field", dst=self.__pool.get("field", labels.shape))
+            return _morph(
+                mask, self.__open_ops, mask,
+                self.__pool.get("tmp", labels.shape))
+
+    def __field_hull(self, field, top):
+        """Get the convex hull of the field
+
+        Parameters
+        ----------
+        field : np.array
+            Cleaned field mask, starting at image row ``top``
+        top : int
+            Image row of the first row of ``field``
+
+        Returns
+        -------
+        np.array or None
+            Convex hull (in image coordinates) of the large field regions, or
+            None if there are none
+        """
+
+        with self.timing.stage("hull"):
+            try:
+                contours = np.concatenate([
+                    c for c in _find_contours(field, offset=(0, top))
+                    if self.__below_horizon(c)
+                ])
+            except ValueError:
+                return None
+
+            return cv2.convexHull(contours)
 
-    def __get_field_mask(self, src):
+    def __get_field_mask(self, labels):
         """Get field mask:
 
         mask <- erode, then dilate thresholded scene
@@ -101,8 +469,8 @@ class VisionModule():
 
         Parameters
         ----------
-        src : np.array -- shape=(WIDTH, HEIGHT, 3)
-            Input image
+        labels : np.array -- shape=(WIDTH, HEIGHT)
+            Color class label image
 
         Returns
         -------
@@ -110,60 +478,123 @@ class VisionModule():
             Object mask
         """
 
-        # Threshold
-        mask = cv2.inRange(src, self.FIELD_LOWER, self.FIELD_UPPER)
+        # Threshold and clean up
+        roi = self.__clean_field(labels[self.__below:])
+        return self.__hull_mask(roi[self.horizon + 1 - self.__below:])
 
-        # Clean up
-        mask = cv2.erode(mask, self.__erode_mask)
-        mask = cv2.dilate(mask, self.__dilate_mask)
-        cv2.rectangle(mask, (0, 0), (640, self.HORIZON), 0, -1)
+    def __hull_mask(self, field):
+        """Get the field mask from the cleaned field, below the horizon
 
-        # Compute and fill convex hull
-        hull_fill = np.zeros(mask.shape, dtype=np.uint8)
-        try:
-            contours = np.concatenate([
-                c for c in _find_contours(mask)
-                if self.__below_horizon(c)
-            ])
+        Parameters
+        ----------
+        field : np.array
+            Cleaned field mask, starting at the row below the horizon
 
-            cvxhull = cv2.convexHull(contours)
-            hull_fill = cv2.fillConvexPoly(hull_fill, cvxhull, 255)
+        Returns
+        -------
+        (np.array, np.array or None)
+            Field mask and convex hull (see ``__get_field_mask``)
+        """
+
+        # Everything above the horizon is discarded
+        top = self.horizon + 1
+        mask = self.__pool.get("mask", (self.height, self.width))
+        mask[:top] = 0
+
+        # Reuse the cached hull while it still covers the field
+        hull_fill = self.__pool.get("hull", field.shape)
+        cvxhull = self.__cached_hull(field, hull_fill)
+
+        # Compute and fill convex hull
+        refill = cvxhull is None
+        if refill:
+            cvxhull = self.__field_hull(field, top)
+            if cvxhull is None:
+                self.__hull = None
+                mask[top:] = field
+                return mask, None
+            if self.hull_refresh:
+                self.__hull = cvxhull
+                self.__hull_age = 0
+                self.__hull_area = cv2.countNonZero(field)
+
+        with self.timing.stage("field_mask"):
+            if refill:
+                hull_fill.fill(0)
+                cv2.fillConvexPoly(
+                    hull_fill, cvxhull - np.array([0, top], dtype=np.int32),
+                    255)
 
             # bitwise AND with !FIELD
-            mask = cv2.bitwise_and(cv2.bitwise_not(mask), hull_fill)
-            return mask, cvxhull
+            cv2.bitwise_and(
+                cv2.bitwise_not(
+                    field, dst=self.__pool.get("tmp", field.shape)),
+                hull_fill, dst=mask[top:])
+        return mask, cvxhull
+
+    def __cached_hull(self, field, hull_fill):
+        """Get the cached field hull, if it is still valid for ``field``
+
+        Parameters
+        ----------
+        field : np.array
+            Cleaned field mask, starting at the row below the horizon
+        hull_fill : np.array
+            Filled cached hull, with the shape of ``field``
+
+        Returns
+        -------
+        np.array or None
+            Cached convex hull, or None if it has to be recomputed
+        """
+
+        if self.__hull is None:
+            return None
+
+        self.__hull_age += 1
+        if self.__hull_age >= self.hull_refresh:
+            return None
+
+        # The field must neither grow out of the hull nor shrink inside it
+        with self.timing.stage("hull_check"):
+            total = cv2.countNonZero(field)
+            inside = cv2.countNonZero(cv2.bitwise_and(
+                field, hull_fill, dst=self.__pool.get("tmp", field.shape)))
+            slack = self.hull_tolerance * self.__hull_area
+            if total - inside > slack or abs(
+                    total - self.__hull_area) > slack:
+                return None
+
+        return self.__hull
+
+    def invalidate_hull(self):
+        """Drop the cached field hull (see ``hull_refresh``); call when the
+        camera moves"""
 
-        except ValueError:
-            return mask, None
+        self.__hull = None
 
-    def __get_object_properties(self, obj, meta):
+    def __get_object_properties(self, rect, meta):
         """Get object properties
 
         Parameters
         ----------
-        obj : np.array
-            Contour (one output of cv2.findContours)
+        rect : int[]
+            Bounding box [x, y, w, h]
         meta : arbitrary type
             Object metadata (is assigned to 'meta' flag)
 
         Returns
         -------
         Object
-            Object with computed bounding box, distance, and tagged metadata
+            Object with distance, bearing, position, and tagged metadata
         """
 
-        x, y, w, h = cv2.boundingRect(obj)
-        try:
-            d = (
-                self.CAM_HEIGHT /
-                math.tan(
-                    self.FOV_V * ((y + h) - self.height / 2) / self.height))
-        except ZeroDivisionError:
-            d = -1
+        dist, bearing, pos = self.projection.locate(rect)
 
-        return Object(rect=[x, y, w, h], dist=d, meta=meta)
+        return Object(
+            rect=rect, dist=dist, meta=meta, bearing=bearing, pos=pos)
 
-    def __mask_to_objects(self, mask, meta):
+    def __mask_to_objects(self, mask, meta, offset=(0, 0)):
         """Convert mask to a list of Objects
 
         Parameters
@@ -172,6 +603,9 @@ class VisionModule():
             Input mask
         meta : arbitrary type
             Mask metadata; all objects are tagged with 'meta'
+        offset : (int, int)
+            Image coordinates of the top left corner of ``mask``, if ``mask``
+            is a region of interest and not the full frame
 
         Returns
         -------
@@ -179,21 +613,116 @@ class VisionModule():
             List of found objects
         """
 
-        try:
-            return [
-                self.__get_object_properties(c, meta)
-                for c in _find_contours(mask)
-            ]
-        except ValueError:
-            return []
+        with self.timing.stage("contours." + meta):
+            if self.extraction == "components":
+                labels = self.__pool.get("components", mask.shape, np.int32)
+                rects, _, _ = _find_components(mask, labels, offset=offset)
+                rects = rects.tolist()
+            else:
+                rects = [
+                    list(cv2.boundingRect(c))
+                    for c in _find_contours(mask, offset=offset)]
+
+            return [self.__get_object_properties(r, meta) for r in rects]
+
+    def __markers(self, labels, meta, offset=(0, 0), bottom=None):
+        """Get green or yellow markers
+
+        Parameters
+        ----------
+        labels : np.array
+            Color class label image (or region of interest)
+        meta : str
+            Marker color; "green" or "yellow"
+        offset : (int, int)
+            Image coordinates of the top left corner of ``labels``
+        bottom : int or None
+            Rows of ``labels`` at or below this row are ignored
+
+        Returns
+        -------
+        Object[]
+            Found markers
+        """
+
+        halo = self.__marker_mask(labels, meta)
+        return self.__mask_to_objects(halo[:bottom], meta, offset)
+
+    def __base(self, labels, offset=(0, 0)):
+        """Get base station markers (see ``__markers``)"""
+
+        base_station = self.__marker_mask(labels, "base")
+        return self.__mask_to_objects(base_station, "base", offset)
+
+    def __marker_mask(self, labels, meta):
+        """Threshold a marker color ("green", "yellow" or "base"), then
+        dilate"""
+
+        with self.timing.stage("mask." + meta):
+            halo = self.classifier.mask(
+                labels, meta, dst=self.__pool.get("marker", labels.shape))
+            return _morph(
+                halo, self.__marker_ops,
+                self.__pool.get("tmp", labels.shape), halo)
+
+    def __cube_mask(self, labels, mask):
+        """Threshold the cube color within the obstacle mask, then dilate,
+        erode and dilate"""
+
+        # Alternates between two buffers, ending in "cube"
+        buf = self.__pool.get("cube", labels.shape)
+        tmp = self.__pool.get("tmp", labels.shape)
+
+        with self.timing.stage("mask.cube"):
+            cube_mask = self.classifier.mask(labels, "cube", dst=tmp)
+            cube_mask = cv2.bitwise_and(mask, cube_mask, dst=tmp)
+            return _morph(cube_mask, self.__cube_ops, buf, tmp)
+
+    def __obstacle_mask(self, mask, cube_mask):
+        """Remove cubes from the obstacle mask, then erode and dilate"""
+
+        # Alternates between two buffers, ending in "obstacle"
+        buf = self.__pool.get("obstacle", mask.shape)
+        tmp = self.__pool.get("tmp", mask.shape)
+
+        with self.timing.stage("mask.obstacle"):
+            obstacle_mask = cv2.bitwise_not(cube_mask, dst=buf)
+            obstacle_mask = cv2.bitwise_and(mask, obstacle_mask, dst=buf)
+            return _morph(obstacle_mask, self.__open_ops, buf, tmp)
+
+    def __cubes_and_obstacles(self, labels, mask, offset=(0, 0)):
+        """Get cubes and obstacles
+
+        Parameters
+        ----------
+        labels : np.array
+            Color class label image (or region of interest)
+        mask : np.array
+            Obstacle mask, with the same shape as ``labels``
+        offset : (int, int)
+            Image coordinates of the top left corner of ``labels``
 
-    def __get_objects(self, src, mask):
+        Returns
+        -------
+        (Object[], Object[])
+            Found cubes, found obstacles
+        """
+
+        cube_mask = self.__cube_mask(labels, mask)
+        cubes = self.__mask_to_objects(cube_mask, "cube", offset)
+
+        obstacle_mask = self.__obstacle_mask(mask, cube_mask)
+        obstacles = self.__mask_to_objects(obstacle_mask, "obstacle", offset)
+
+        return cubes, obstacles
+
+    def __get_objects(self, labels, mask):
         """Get cubes and obstacles in the scene
 
         Parameters
         ----------
-        src : np.array -- size=(WIDTH, HEIGHT, 3)
-            Input image
+        labels : np.array -- size=(WIDTH, HEIGHT)
+            Color class label image
         mask : np.array -- size=(WIDTH, HEIGHT)
             Obstacle Mask
 
@@ -205,89 +734,937 @@ class VisionModule():
 
         # cv2.imshow("src", src)
 
-        green_halo = cv2.inRange(src, self.GREEN_LOWER, self.GREEN_UPPER)
-        green_halo = cv2.dilate(green_halo, self.__dilate_mask)
-        cv2.rectangle(green_halo, (0, self.HORIZON), (640, 480), 0, -1)
-        green = self.__mask_to_objects(green_halo, "green")
+        # Markers: above the horizon only
+        above = labels[:self.__above]
+        green = self.__markers(above, "green", bottom=self.horizon)
+        yellow = self.__markers(above, "yellow", bottom=self.horizon)
 
-        yellow_halo = cv2.inRange(src, self.YELLOW_LOWER, self.YELLOW_UPPER)
-        yellow_halo = cv2.dilate(yellow_halo, self.__dilate_mask)
-        cv2.rectangle(yellow_halo, (0, self.HORIZON), (640, 480), 0, -1)
-        yellow = self.__mask_to_objects(yellow_halo, "yellow")
+        base = self.__base(labels)
 
-        base_station = cv2.inRange(
-            src, self.BASE_STATION_LOWER, self.BASE_STATION_UPPER)
-        base_station = cv2.dilate(base_station, self.__dilate_mask)
-        base = self.__mask_to_objects(base_station, "base")
+        # Cubes and obstacles: below the horizon only (the field mask is
+        # empty above it)
+        top = self.__below
+        cubes, obstacles = self.__cubes_and_obstacles(
+            labels[top:], mask[top:], offset=(0, top))
 
-        cube_mask = cv2.inRange(src, self.CUBE_LOWER, self.CUBE_UPPER)
-        cube_mask = cv2.bitwise_and(mask, cube_mask)
-        cube_mask = cv2.dilate(cube_mask, self.__dilate_mask)
-        cube_mask = cv2.erode(cube_mask, self.__cube_erode_mask)
-        cube_mask = cv2.dilate(cube_mask, self.__dilate_mask)
+        return cubes + obstacles + yellow + green + base
 
-        cubes = self.__mask_to_objects(cube_mask, "cube")
+    def __cover(self, img, rect, hull_fill):
+        """Classify a region of interest for the cascade refinement
 
-        mask = cv2.bitwise_and(mask, cv2.bitwise_not(cube_mask))
-        mask = cv2.erode(mask, self.__erode_mask)
-        mask = cv2.dilate(mask, self.__dilate_mask)
+        Labels and the obstacle mask of the region are written into the
+        full-frame ``labels`` and ``mask`` buffers, so that candidates
+        sharing a region share its classification. Only the bounding box
+        of the part of the region not processed yet (nonzero in the
+        ``uncovered`` buffer) is processed.
 
-        obstacles = self.__mask_to_objects(mask, "obstacle")
+        Parameters
+        ----------
+        img : np.array
+            Full resolution image
+        rect : [x0, y0, x1, y1]
+            Region of interest
+        hull_fill : np.array or None
+            Filled convex hull of the field (full frame), if any
+        """
 
-        return cubes + obstacles + yellow + green + base
+        uncovered = self.__pool.get("uncovered", (self.height, self.width))
+        x, y, w, h = cv2.boundingRect(
+            uncovered[rect[1]:rect[3], rect[0]:rect[2]])
+        if not w:
+            return
+        x0, y0 = rect[0] + x, rect[1] + y
+        roi = (slice(y0, y0 + h), slice(x0, x0 + w))
+
+        labels = self.__pool.get("labels", (self.height, self.width))[roi]
+        self.__classify(img[roi], dst=labels)
+
+        field = self.__clean_field(labels)
+        mask = self.__pool.get("mask", (self.height, self.width))[roi]
+        if hull_fill is not None:
+            cv2.bitwise_and(
+                cv2.bitwise_not(
+                    field, dst=self.__pool.get("tmp", field.shape)),
+                hull_fill[roi], dst=mask)
+        else:
+            np.copyto(mask, field)
+        mask[:max(0, self.horizon + 1 - y0)] = 0
+        uncovered[roi] = 0
+
+    def __refine(self, rect, meta):
+        """Find the objects of a class in a region of interest, from the
+        labels and obstacle mask computed by ``__cover``
 
-    def __inside(self, target, refs):
+        Parameters
+        ----------
+        rect : [x0, y0, x1, y1]
+            Region of interest
+        meta : str
+            Object class
 
-        for r in refs:
-            if (r.rect[0] - self.isolate < target.rect[0] and (
-                    r.rect[0] + r.rect[2] + self.isolate >
-                    target.rect[0] + target.rect[2])):
-                return True
-        return False
+        Returns
+        -------
+        Object[]
+            Objects found in the region, in full-frame coordinates
+        """
 
-    def __contains(self, target, refs):
+        x0, y0, x1, y1 = rect
+        roi = (slice(y0, y1), slice(x0, x1))
+        offset = (x0, y0)
+        labels = self.__pool.get("labels", (self.height, self.width))[roi]
+        horizon = self.horizon - y0
+
+        if meta in ["green", "yellow"]:
+            if horizon <= 0:
+                return []
+            return self.__markers(labels, meta, offset, horizon)
+        if meta == "base":
+            return self.__base(labels, offset)
+
+        # Only the chain of the candidate's class: obstacles need the cube
+        # mask, cubes do not need the obstacle mask
+        mask = self.__pool.get("mask", (self.height, self.width))[roi]
+        cube_mask = self.__cube_mask(labels, mask)
+        if meta == "cube":
+            return self.__mask_to_objects(cube_mask, "cube", offset)
+        return self.__mask_to_objects(
+            self.__obstacle_mask(mask, cube_mask), "obstacle", offset)
+
+    def __refine_candidate(self, img, box, meta, hull_fill, pad, bounds):
+        """Refine a coarse candidate
+
+        The candidate is refined in its box, padded by ``pad``. Regions also
+        catch (parts of) neighbouring objects; only the objects overlapping
+        the candidate's box are kept. While those touch the region's edge
+        (i.e. extend past it), the region is grown on those sides, and only
+        the strips added to it are classified.
 
-        for r in refs:
-            if (target.rect[0] - self.isolate < r.rect[0] and (
-                    target.rect[0] + target.rect[2] + self.isolate >
-                    r.rect[0] + r.rect[2])):
-                return True
-        return False
+        Returns
+        -------
+        (Object[], [x0, y0, x1, y1])
+            Objects found, and the region they were found in
+        """
 
-    def process(self, img):
-        """Process image
+        def overlapping(objs):
+            return [
+                o for o in objs if regions.overlaps(box, [
+                    o.rect[0], o.rect[1],
+                    o.rect[0] + o.rect[2], o.rect[1] + o.rect[3]])]
+
+        rect = regions.expand(box, pad, bounds)
+        found = overlapping(self.__refine(rect, meta))
+        for _ in range(self.CASCADE_GROW):
+            # Extend the sides objects touch by ``pad``
+            grown = list(rect)
+            for obj in found:
+                x, y, w, h = obj.rect
+                for i, edge in enumerate([x, y, x + w, y + h]):
+                    if edge == rect[i] != bounds[i]:
+                        grown[i] = (
+                            max(bounds[i], rect[i] - pad) if i < 2 else
+                            min(bounds[i], rect[i] + pad))
+            if grown == rect:
+                break
+
+            # Strips above, below, left and right of the old region
+            x0, y0, x1, y1 = rect
+            for strip in [
+                    [grown[0], grown[1], grown[2], y0],
+                    [grown[0], y1, grown[2], grown[3]],
+                    [grown[0], y0, x0, y1], [x1, y0, grown[2], y1]]:
+                if strip[0] < strip[2] and strip[1] < strip[3]:
+                    self.__cover(img, strip, hull_fill)
+            rect = grown
+            found = overlapping(self.__refine(rect, meta))
+
+        return found, rect
+
+    def __detect_cascade(self, img):
+        """Coarse-to-fine detection
+
+        The coarse module finds candidate objects in a subsampled frame.
+        The union of the regions around candidates is classified once at
+        full resolution (see ``__cover``); each candidate is then refined
+        separately, so that neighbouring objects are not merged (see
+        ``__refine_candidate``). The field mask and convex hull are taken
+        from the coarse pass.
 
         Parameters
         ----------
-        img : np.array, size=(WIDTH, HEIGHT, 3)
-            Input BGR image
+        img : np.array
+            Full resolution BGR image
+
+        Returns
+        -------
+        (Object[], np.array, np.array or None)
+            Unfiltered objects, field mask, field convex hull
+        """
+
+        c = self.cascade
+        with self.timing.stage("coarse"):
+            # Subsampled rather than averaged: averaging blends the gaps
+            # between field-colored background and the field, which then
+            # pushes the field hull above the field edge
+            small = cv2.resize(
+                img, (self.__coarse.width, self.__coarse.height),
+                interpolation=cv2.INTER_NEAREST)
+            candidates, mask, cvxhull = self.__coarse.__detect(small)
+
+        mask = cv2.resize(
+            mask, (self.width, self.height),
+            dst=self.__pool.get("upscaled", (self.height, self.width)),
+            interpolation=cv2.INTER_NEAREST)
+        if cvxhull is not None:
+            cvxhull = cvxhull * c
+
+        hull_fill = None
+        if cvxhull is not None:
+            hull_fill = self.__pool.get("hull", (self.height, self.width))
+            hull_fill.fill(0)
+            cv2.fillConvexPoly(hull_fill, cvxhull, 255)
+
+        # Candidate boxes are accurate to a coarse pixel; regions are padded
+        # by that and the reach of the last dilate
+        pad = self.__cascade_pad
+        bounds = [0, 0, self.width, self.height]
+        boxes = [
+            ([x * c, y * c, (x + w) * c, (y + h) * c], o.meta)
+            for o in candidates for x, y, w, h in [o.rect]]
+
+        # Classify the union of the candidate regions once
+        self.__pool.get("uncovered", (self.height, self.width)).fill(255)
+        for rect in regions.merge(
+                [regions.expand(box, pad, bounds) for box, _ in boxes]):
+            self.__cover(img, rect, hull_fill)
+
+        objs, seen, self.refined = [], set(), []
+        for box, meta in boxes:
+            found, rect = self.__refine_candidate(
+                img, box, meta, hull_fill, pad, bounds)
+            self.refined.append((
+                [rect[0], rect[1], rect[2] - rect[0], rect[3] - rect[1]],
+                [meta]))
+
+            # Neighbouring candidates can find the same object
+            for obj in found:
+                key = (obj.meta, tuple(obj.rect))
+                if key not in seen:
+                    seen.add(key)
+                    objs.append(obj)
+
+        return objs, mask, cvxhull
+
+    def __update(self, out, rects, reach, rows, stage):
+        """Recompute a stage on the regions affected by changed inputs
+
+        Parameters
+        ----------
+        out : np.array
+            Persistent full-frame stage output
+        rects : [x0, y0, x1, y1][]
+            Regions where the stage inputs changed
+        reach : int
+            Maximum distance an input change can propagate through the stage
+        rows : (int, int)
+            Range of image rows the stage is computed on
+        stage : f(np.s_) -> np.array
+            Computes the stage output for a region (given as a slice)
+
+        Returns
+        -------
+        [x0, y0, x1, y1][]
+            Regions of ``out`` that were updated
+        """
+
+        bounds = [0, rows[0], self.width, rows[1]]
+        updated = regions.merge(regions.clip(
+            [regions.expand(r, reach, bounds) for r in rects], bounds))
+
+        # Each region is computed with another ``reach`` of padding, so that
+        # kernel borders do not affect the updated pixels
+        for x0, y0, x1, y1 in updated:
+            px0, py0, px1, py1 = regions.expand(
+                [x0, y0, x1, y1], reach, bounds)
+            result = stage(np.s_[py0:py1, px0:px1])
+            out[y0:y1, x0:x1] = result[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+
+        return updated
+
+    def __update_objects(self, objs, mask, rects, meta, rows):
+        """Re-extract the objects in updated regions of a mask
+
+        Cached objects touching an updated region are dropped, and the region
+        grown to cover them, so that objects are never split across regions.
+
+        Parameters
+        ----------
+        objs : Object[]
+            Cached objects
+        mask : np.array
+            Full-frame mask
+        rects : [x0, y0, x1, y1][]
+            Updated regions of ``mask``
+        meta : str
+            Object class
+        rows : (int, int)
+            Range of image rows objects are extracted from
 
         Returns
         -------
         Object[]
-            List of found objects
+            Updated objects
+        """
+
+        bounds = [0, rows[0], self.width, rows[1]]
+        todo = regions.clip(
+            [regions.expand(r, 1, bounds) for r in rects], bounds)
+        if not todo:
+            return objs
+
+        while True:
+            todo = regions.merge(todo)
+            kept, stale = [], []
+            for o in objs:
+                x, y, w, h = o.rect
+                box = regions.expand([x, y, x + w, y + h], 1, bounds)
+                if any(regions.overlaps(box, r) for r in todo):
+                    stale.append(box)
+                else:
+                    kept.append(o)
+            if not stale:
+                break
+            objs = kept
+            todo += stale
+
+        for x0, y0, x1, y1 in todo:
+            objs = objs + self.__mask_to_objects(
+                mask[y0:y1, x0:x1], meta, (x0, y0))
+        return objs
+
+    def __detect_incremental(self, img):
+        """Incremental detection
+
+        Every stage keeps its full-frame output between frames; a stage is
+        only recomputed around the regions where its inputs changed, starting
+        from the tiles that differ from the last processed frame.
+
+        Parameters
+        ----------
+        img : np.array
+            BGR image
+
+        Returns
+        -------
+        (Object[], np.array, np.array or None)
+            Unfiltered objects, field mask, field convex hull
+        """
+
+        shape = (self.height, self.width)
+        full = [0, 0, self.width, self.height]
+        state = self.__state
+        prev = state.get("prev", shape + (3,))
+
+        if self.__cache is None:
+            dirty = [full]
+        else:
+            dirty = regions.dirty_rects(
+                img, prev, self.tile, self.tile_threshold,
+                dst=self.__pool.get("diff", shape + (3,)))
+            area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in dirty)
+            if area > self.width * self.height // 2:
+                dirty = [full]
+        self.dirty = dirty
+
+        if not dirty:
+            objs, cvxhull = self.__cache
+            return self.__collect(objs), state.get("mask", shape), cvxhull
+
+        # Cached results always correspond to the contents of ``prev``; tiles
+        # below the threshold are not copied, so slow drift is still caught
+        labels = state.get("labels", shape)
+        for x0, y0, x1, y1 in dirty:
+            prev[y0:y1, x0:x1] = img[y0:y1, x0:x1]
+            labels[y0:y1, x0:x1] = self.__classify(img[y0:y1, x0:x1])
+
+        if self.__cache is None:
+            objs = {}
+            cvxhull = None
+            state.get("mask", shape).fill(0)
+        else:
+            objs, cvxhull = self.__cache
+
+        def update_objects(meta, mask, rects, rows):
+            objs[meta] = self.__update_objects(
+                objs.get(meta, []), mask, rects, meta, rows)
+
+        # Markers
+        for meta, rows in [
+                ("green", (0, self.__above)), ("yellow", (0, self.__above)),
+                ("base", (0, self.height))]:
+            out = state.get(meta, shape)
+            updated = self.__update(
+                out, dirty, self.dilate_ksize, rows,
+                lambda r: self.__marker_mask(labels[r], meta))
+            update_objects(
+                meta, out,
+                updated, (0, self.horizon if meta != "base" else rows[1]))
+
+        # Field mask and hull
+        top = self.horizon + 1
+        lower = (self.__below, self.height)
+        field = state.get("field", shape)
+        changed = regions.clip(self.__update(
+            field, dirty, self.erode_ksize + self.dilate_ksize, lower,
+            lambda r: self.__clean_field(labels[r])), [0, top] + full[2:])
+
+        if changed or self.__cache is None:
+            new_hull = self.__field_hull(field[top:], top)
+            if (self.__cache is None or new_hull is None or
+                    cvxhull is None or not np.array_equal(new_hull, cvxhull)):
+                changed = [[0, top, self.width, self.height]]
+                hull_fill = state.get("hull", shape)
+                hull_fill.fill(0)
+                if new_hull is not None:
+                    cv2.fillConvexPoly(hull_fill, new_hull, 255)
+            cvxhull = new_hull
+
+        mask = state.get("mask", shape)
+        hull_fill = state.get("hull", shape)
+
+        def obstacle_mask(r):
+            if cvxhull is None:
+                return field[r]
+            tmp = self.__pool.get("tmp", field[r].shape)
+            return cv2.bitwise_and(
+                cv2.bitwise_not(field[r], dst=tmp), hull_fill[r], dst=tmp)
+
+        changed = self.__update(
+            mask, changed, 0, (top, self.height), obstacle_mask)
+
+        # Cubes and obstacles
+        cube = state.get("cube", shape)
+        updated = self.__update(
+            cube, dirty + changed, 2 * self.dilate_ksize + self.erode_ksize,
+            lower, lambda r: self.__cube_mask(labels[r], mask[r]))
+        update_objects("cube", cube, updated, lower)
+
+        obstacle = state.get("obstacle", shape)
+        updated = self.__update(
+            obstacle, updated + changed, self.erode_ksize + self.dilate_ksize,
+            lower, lambda r: self.__obstacle_mask(mask[r], cube[r]))
+        update_objects("obstacle", obstacle, updated, lower)
+
+        self.__cache = (objs, cvxhull)
+        return self.__collect(objs), mask, cvxhull
+
+    def __parallel(self, outs, rows, reach, stage):
+        """Compute a stage on horizontal strips, in parallel
+
+        Parameters
+        ----------
+        outs : np.array[]
+            Full-frame stage outputs
+        rows : (int, int)
+            Range of image rows the stage is computed on
+        reach : int
+            Maximum distance (in rows) the stage propagates its input; each
+            strip is computed with this much padding above and below
+        stage : f(VisionModule, np.s_) -> np.array[]
+            Computes the stage outputs for a padded strip (given as a slice)
+            using the buffers of a strip module; one array per ``outs``
+        """
+
+        n = len(self.__strips)
+        edges = [rows[0] + (rows[1] - rows[0]) * i // n for i in range(n + 1)]
+
+        def run(i):
+            y0, y1 = edges[i], edges[i + 1]
+            if y0 == y1:
+                return
+            py0, py1 = max(rows[0], y0 - reach), min(rows[1], y1 + reach)
+            results = stage(self.__strips[i], np.s_[py0:py1])
+            for out, result in zip(outs, results):
+                out[y0:y1] = result[y0 - py0:y1 - py0]
+
+        # Consume the results, to raise any exceptions
+        list(self.__executor.map(run, range(n)))
+
+    def __detect_parallel(self, img):
+        """Detection with strip stages computed in parallel
+
+        Classification and all erode/dilate chains run on strips (see
+        ``__parallel``); the field hull and contour extraction need the
+        whole frame, and run on the stitched masks.
+
+        Parameters
+        ----------
+        img : np.array
+            BGR image
+
+        Returns
+        -------
+        (Object[], np.array, np.array or None)
+            Unfiltered objects, field mask, field convex hull
+        """
+
+        shape = (self.height, self.width)
+        state = self.__state
+        top = self.__below
+        labels = state.get("labels", shape)
+
+        with self.timing.stage("classify"):
+            self.__parallel([], (0, self.height), 0, lambda m, r: (
+                m.__classify(img[r], dst=labels[r]),))
+
+        with self.timing.stage("mask.markers"):
+            for meta, bottom in [
+                    ("green", self.__above), ("yellow", self.__above),
+                    ("base", self.height)]:
+                self.__parallel(
+                    [state.get(meta, shape)], (0, bottom), self.dilate_ksize,
+                    lambda m, r: (m.__marker_mask(labels[r], meta),))
+
+        with self.timing.stage("field"):
+            field = state.get("field", shape)
+            self.__parallel(
+                [field], (top, self.height),
+                self.erode_ksize + self.dilate_ksize,
+                lambda m, r: (m.__clean_field(labels[r]),))
+        mask, cvxhull = self.__hull_mask(field[self.horizon + 1:])
+
+        # Cube and obstacle masks in one pass; obstacles depend on cubes, so
+        # strips are padded by the reach of both chains
+        with self.timing.stage("mask.objects"):
+            cube = state.get("cube", shape)
+            obstacle = state.get("obstacle", shape)
+
+            def objects(m, r):
+                cube_mask = m.__cube_mask(labels[r], mask[r])
+                return cube_mask, m.__obstacle_mask(mask[r], cube_mask)
+
+            self.__parallel(
+                [cube, obstacle], (top, self.height), self.__halo, objects)
+
+        above = state.get("green", shape)[:self.horizon]
+        green = self.__mask_to_objects(above, "green")
+        above = state.get("yellow", shape)[:self.horizon]
+        yellow = self.__mask_to_objects(above, "yellow")
+        base = self.__mask_to_objects(state.get("base", shape), "base")
+        cubes = self.__mask_to_objects(cube[top:], "cube", (0, top))
+        obstacles = self.__mask_to_objects(
+            obstacle[top:], "obstacle", (0, top))
+
+        return cubes + obstacles + yellow + green + base, mask, cvxhull
+
+    @staticmethod
+    def __collect(objs):
+        """Concatenate per-class objects in the order of ``__get_objects``"""
+
+        return [
+            o for meta in ["cube", "obstacle", "yellow", "green", "base"]
+            for o in objs.get(meta, [])]
+
+    def reset(self):
+        """Drop cached results; the next frame is processed in full"""
+
+        self.__cache = None
+        self.__hull = None
+
+    def __classify(self, img, dst=None):
+        """Convert a BGR image (or region of interest) to HSV and label it;
+        YUV images are labeled directly
+
+        Returns
+        -------
+        np.array
+            Label image, written to ``dst`` if given, or else backed by the
+            ``labels`` buffer
+        """
+
+        shape = img.shape[:2]
+        if self.color == "hsv":
+            with self.timing.stage("color"):
+                img = cv2.cvtColor(
+                    img, cv2.COLOR_BGR2HSV,
+                    dst=self.__pool.get("hsv", shape + (3,)))
+        if dst is None:
+            dst = self.__pool.get("labels", shape)
+        with self.timing.stage("classify"):
+            return self.classifier.classify(
+                img, dst=dst,
+                work=self.__pool.get("index", shape, dtype=np.intp))
+
+    def __detect(self, img):
+        """Find all objects in an image, without filtering
+
+        Parameters
+        ----------
+        img : np.array -- size=(WIDTH, HEIGHT, 3)
+            Input BGR image
+
+        Returns
+        -------
+        (Object[], np.array, np.array or None)
+            Unfiltered objects, field mask, field convex hull
+        """
+
+        if self.__coarse is not None:
+            return self.__detect_cascade(img)
+        if self.incremental:
+            return self.__detect_incremental(img)
+        if self.__strips:
+            return self.__detect_parallel(img)
+
+        labels = self.__classify(img)
+
+        mask, cvxhull = self.__get_field_mask(labels)
+        objs = self.__get_objects(labels, mask)
+
+        return objs, mask, cvxhull
+
+    def __detect_lazy(self, img, want):
+        """Find the objects of the requested classes in an image, without
+        filtering; only the stages they depend on are evaluated (see
+        ``STAGES``), and only the label image rows those stages read are
+        classified
+
+        Parameters
+        ----------
+        img : np.array -- size=(WIDTH, HEIGHT, 3)
+            Input BGR image
+        want : set
+            Requested outputs (keys of ``STAGES``)
+
+        Returns
+        -------
+        (Object[], np.array or None, np.array or None)
+            Unfiltered objects, field mask and field convex hull (None if
+            the field stage was not needed)
+        """
+
+        stages = set(s for name in want for s in self.STAGES[name])
+        if not stages:
+            return [], None, None
+        spans = [self.__stage_rows[s] for s in stages]
+        start = min(r[0] for r in spans)
+        end = max(r[1] for r in spans)
+
+        labels = self.__pool.get("labels", (self.height, self.width))
+        self.__classify(img[start:end], dst=labels[start:end])
+
+        mask = cvxhull = None
+        if "field" in stages:
+            mask, cvxhull = self.__get_field_mask(labels)
+
+        objs = {}
+        top = self.__below
+        if "cube" in stages:
+            cube_mask = self.__cube_mask(labels[top:], mask[top:])
+            if "cube" in want:
+                objs["cube"] = self.__mask_to_objects(
+                    cube_mask, "cube", (0, top))
+        if "obstacle" in stages:
+            obstacle_mask = self.__obstacle_mask(mask[top:], cube_mask)
+            objs["obstacle"] = self.__mask_to_objects(
+                obstacle_mask, "obstacle", (0, top))
+
+        above = labels[:self.__above]
+        for meta in ["yellow", "green"]:
+            if meta in stages:
+                objs[meta] = self.__markers(above, meta, bottom=self.horizon)
+        if "base" in stages:
+            objs["base"] = self.__base(labels)
+
+        return self.__collect(objs), mask, cvxhull
+
+    def __pack_yuv(self, i420, size):
+        """Convert a planar I420 buffer to a (H, W, 3) YUV image
+
+        Chroma is upsampled by pixel repetition, so each pixel keeps the
+        (U, V) sample of its 2x2 block, as in ``cv2.COLOR_YUV2BGR_I420``.
+        """
+
+        h, w = size
+        flat = i420.reshape(-1)
+        u = flat[h * w:h * w + h * w // 4].reshape(h // 2, w // 2)
+        v = flat[h * w + h * w // 4:].reshape(h // 2, w // 2)
+
+        chroma = []
+        for name, plane in [("chroma_u", u), ("chroma_v", v)]:
+            chroma.append(cv2.resize(
+                plane, (w, h), dst=self.__pool.get(name, size),
+                interpolation=cv2.INTER_NEAREST))
+
+        name = "input" if size == (self.height, self.width) else "convert"
+        return cv2.merge(
+            [i420[:h]] + chroma, dst=self.__pool.get(name, size + (3,)))
+
+    def __input(self, img, fmt):
+        """Input stage: bring a frame to (height, width, 3) in the module's
+        color space (BGR, or YUV if ``color`` is "yuv")
+
+        A BGR frame that already has the right shape is returned as is (no
+        copy); anything else is converted and/or resized into the "input"
+        buffer.
+
+        Parameters
+        ----------
+        img : np.array
+            Input frame
+        fmt : str
+            "bgr" for a (H, W, 3) image, or "yuv420" for a planar I420
+            buffer of shape (H * 3 / 2, W), as delivered by the camera's
+            video port
+
+        Returns
+        -------
+        np.array -- shape=(HEIGHT, WIDTH, 3), dtype=np.uint8
+            BGR or YUV image
         """
 
-        if img.shape != (self.width, self.height):
-            img = cv2.resize(img, (self.width, self.height))
+        if img.dtype != np.uint8:
+            raise ValueError(
+                "Expected a uint8 image, got {}".format(img.dtype))
+
+        shape = (self.height, self.width, 3)
+        if fmt == "yuv420":
+            if img.ndim != 2 or img.shape[0] % 3:
+                raise ValueError(
+                    "Expected an I420 buffer, got shape {}".format(img.shape))
+            size = (img.shape[0] * 2 // 3, img.shape[1])
+            name = "input" if size == shape[:2] else "convert"
+            if self.color == "yuv":
+                img = self.__pack_yuv(img, size)
+            else:
+                img = cv2.cvtColor(
+                    img, cv2.COLOR_YUV2BGR_I420,
+                    dst=self.__pool.get(name, size + (3,)))
+        elif fmt == "bgr":
+            if img.ndim != 3 or img.shape[2] != 3:
+                raise ValueError(
+                    "Expected a 3 channel image, got shape {}".format(
+                        img.shape))
+            if self.color == "yuv":
+                i420 = cv2.cvtColor(
+                    img, cv2.COLOR_BGR2YUV_I420,
+                    dst=self.__pool.get(
+                        "i420", (img.shape[0] * 3 // 2, img.shape[1])))
+                img = self.__pack_yuv(i420, img.shape[:2])
+        else:
+            raise ValueError("Unknown image format '{}'".format(fmt))
+
+        if img.shape == shape:
+            return img
+
+        return cv2.resize(
+            img, (self.width, self.height),
+            dst=self.__pool.get("input", shape))
+
+    def process(self, img, fmt="bgr", want=None, as_array=False):
+        """Process image
 
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        The image is used in place if it is already (HEIGHT, WIDTH, 3) and in
+        the module's color space; otherwise it is converted and/or resized
+        first.
 
-        mask, cvxhull = self.__get_field_mask(img)
-        objs = self.__get_objects(img, mask)
+        Parameters
+        ----------
+        img : np.array -- shape=(HEIGHT, WIDTH, 3)
+            Input BGR image, or a planar YUV420 (I420) buffer with shape
+            (HEIGHT * 3 / 2, WIDTH) if ``fmt`` is "yuv420". Other sizes are
+            resized.
+        fmt : str
+            Input format; "bgr" or "yuv420"
+        want : iterable or None
+            If given, only these outputs are computed: any of "cube",
+            "obstacle", "yellow", "green", "base" (objects of that class) and
+            "field" (field mask and hull), i.e. ``{"cube", "obstacle"}``.
+            Only objects of the requested classes are returned, and only
+            they take part in post-processing, so an unrequested object does
+            not suppress the requested objects inside it. In cascade,
+            incremental and parallel modes, everything is still computed.
+        as_array : bool
+            If True, objects are returned as an ``objects.OBJECT_DTYPE``
+            structured array (see ``objects.of_class`` etc.)
 
-        final = []
-        objs.sort(key=lambda x: x.rect[2], reverse=True)
-        for x in objs:
+        Returns
+        -------
+        Object[] or np.array
+            List of found objects
+        np.array or None
+            Field mask. References an internal buffer that is overwritten by
+            the next call to ``process``. None if not computed (see
+            ``want``).
+        np.array or None
+            Convex hull of the field, if found
+        """
 
-            if x.meta in ["yellow", "blue", "green"]:
-                if x.rect[2] > 25:
-                    final.append(x)
-            elif x.meta in ["base"]:
-                if x.rect[2] < 100 and x.rect[3] > 50:
-                    final.append(x)
+        if want is not None:
+            want = set(want)
+            unknown = want.difference(self.STAGES)
+            if unknown:
+                raise ValueError(
+                    "Unknown outputs {}".format(sorted(unknown)))
+
+        with self.timing.stage("total"):
+            with self.timing.stage("input"):
+                img = self.__input(img, fmt)
+            if want is None:
+                objs, mask, cvxhull = self.__detect(img)
+            elif self.__coarse is not None or self.incremental or (
+                    self.__strips):
+                objs, mask, cvxhull = self.__detect(img)
+                objs = [o for o in objs if o.meta in want]
             else:
-                if not self.__inside(x, final):
-                    final.append(x)
+                objs, mask, cvxhull = self.__detect_lazy(img, want)
+            with self.timing.stage("postprocess"):
+                objs = self.postprocess(objs)
+                if as_array:
+                    objs = to_array(objs)
+
+        return objs, mask, cvxhull
+
+    def process_batch(self, frames, workers=None, masks=False, chunksize=4):
+        """Process a batch of frames in a pool of worker processes
+
+        Parameters
+        ----------
+        frames : iterable of np.array
+            Input BGR images; streamed to the workers
+        workers : int or None
+            Number of worker processes, each with its own ``VisionModule``
+            built from ``options``; defaults to the number of CPUs. If 1,
+            frames are processed by this module, in this process.
+        masks : bool
+            If False (default), field masks are not sent back from the
+            workers, and are returned as None.
+        chunksize : int
+            Number of frames handed to a worker at once
+
+        Returns
+        -------
+        [Object[], np.array or None, np.array or None][]
+            ``process`` output for each frame, in order
+        batch.BatchStats
+            Number of frames, total time, and aggregate throughput
+        """
+
+        return batch.process_batch(
+            self, frames, workers=workers, masks=masks, chunksize=chunksize)
+
+    def process_directory(self, path, workers=None, masks=False, chunksize=4):
+        """Process all images in a directory, in filename order
+
+        Images are loaded by the workers themselves. See ``process_batch``
+        for arguments.
+
+        Returns
+        -------
+        (str, [Object[], np.array or None, np.array or None])[]
+            Filename and ``process`` output for each image, in order
+        batch.BatchStats
+            Number of frames, total time, and aggregate throughput; images
+            that could not be read are left out of the results, and listed
+            in ``skipped``
+        """
 
-        return final, mask, cvxhull
+        return batch.process_directory(
+            self, path, workers=workers, masks=masks, chunksize=chunksize)
+
+
+class Tests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+
+        path = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "samples")
+        cls.frames = [
+            cv2.resize(cv2.imread(os.path.join(path, f)), (640, 480))
+            for f in sorted(os.listdir(path))
+            if f.split('.')[-1] in batch.ALLOWED_EXTENSIONS]
+
+    def assertSameOutput(self, out, expected):
+        """Check that two ``process`` outputs are identical"""
+
+        (objs, mask, cvxhull), (e_objs, e_mask, e_cvxhull) = out, expected
+        self.assertEqual(
+            sorted((o.meta, o.rect, o.dist) for o in objs),
+            sorted((o.meta, o.rect, o.dist) for o in e_objs))
+        self.assertTrue(np.array_equal(mask, e_mask))
+        if e_cvxhull is None:
+            self.assertIsNone(cvxhull)
+        else:
+            self.assertTrue(np.array_equal(cvxhull, e_cvxhull))
+
+    def test_incremental(self):
+
+        full = VisionModule()
+        mod = VisionModule(incremental=True, tile_threshold=0)
+
+        # Each sample, then partly overwritten by the next, then unchanged
+        for img, nxt in zip(self.frames, self.frames[1:] + self.frames[:1]):
+            changed = img.copy()
+            changed[200:330, 150:420] = nxt[200:330, 150:420]
+            for frame in [img, changed, changed]:
+                self.assertSameOutput(
+                    mod.process(frame), full.process(frame))
+            self.assertEqual(mod.dirty, [])
+
+    def test_parallel(self):
+
+        full = VisionModule()
+        for threads in [2, 3, 4]:
+            mod = VisionModule(threads=threads)
+            for img in self.frames:
+                self.assertSameOutput(mod.process(img), full.process(img))
+
+    def test_hull_cache(self):
+
+        full = VisionModule()
+        for refresh in [1, 30]:
+            mod = VisionModule(hull_refresh=refresh)
+            for img in self.frames:
+                for _ in range(3):
+                    self.assertSameOutput(mod.process(img), full.process(img))
+
+        # Held frames reuse the cached hull; scene changes recompute it
+        self.assertEqual(
+            mod.timing.summary()["hull"]["count"], len(self.frames))
+
+    def test_cascade(self):
+
+        full = VisionModule()
+        mod = VisionModule(cascade=4)
+
+        def center(o):
+            x, y, w, h = o.rect
+            return x + w / 2, y + h / 2
+
+        def contains(o, p):
+            x, y, w, h = o.rect
+            return x <= p[0] < x + w and y <= p[1] < y + h
+
+        for img in self.frames:
+            expected = full.process(img)[0]
+            objs = mod.process(img)[0]
+
+            # No merged or spurious objects: each contains the center of
+            # exactly one object of its class found by the full pass
+            for o in objs:
+                self.assertEqual(sum(
+                    contains(o, center(e)) for e in expected
+                    if e.meta == o.meta), 1, o)
+
+            # Objects of at least 4 coarse pixels are found
+            for e in expected:
+                if min(e.rect[2:]) >= 4 * mod.cascade:
+                    self.assertTrue(any(
+                        contains(o, center(e)) for o in objs
+                        if o.meta == e.meta), e)
+
+            # Only a fraction of the frame is processed at full resolution
+            refined = np.zeros(img.shape[:2], dtype=bool)
+            for (x, y, w, h), _ in mod.refined:
+                refined[y:y + h, x:x + w] = True
+            self.assertLess(refined.mean(), 0.25)
@@ -3,11 +3,33 @@
 LED3 indicates vision processing.
 """
 
+import asyncio
+import collections
+import os
+import tempfile
 import time
 import threading
+import unittest
+
+import numpy as np
 
 from .vision import VisionModule
-from .camera import Camera
+from .camera import Camera, FakePiCamera
+from .replay import ReplayCamera
+from .ring import FrameRing
+from .worker import VisionProcess
+
+
+VisionOutput = collections.namedtuple(
+    "VisionOutput",
+    ["objects", "mask", "cvxhull", "seq", "timestamp", "processed"])
+VisionOutput.__doc__ = """Processed frame
+
+objects, mask and cvxhull are the output of ``VisionModule.process``; seq is
+the frame's capture sequence number (gaps are frames dropped because
+processing was busy), timestamp its capture time and processed the time
+processing finished (both ``time.time()``).
+"""
 
 
 class VisionModuleThread(threading.Thread):
@@ -17,42 +39,394 @@ class VisionModuleThread(threading.Thread):
     -----
     mod = VisionModuleThread()
     mod.start()  # run in separate thread
+
+    If ``yuv`` is True, frames are captured and classified in YUV (see
+    ``VisionModule(color="yuv")``). Other keyword arguments (i.e. ``horizon``
+    for this robot's camera mount) are passed on to the ``VisionModule``;
+    ``source`` is passed on to the ``Camera``. Another camera (i.e. a
+    ``replay.ReplayCamera``) can be given as ``camera``; ``finished`` is set
+    once it runs out of frames. If a ``recorder.Recorder`` is given, every
+    processed frame is recorded with its results.
+
+    With ``out_of_process=True``, the ``VisionModule`` runs in a worker
+    process (see ``worker.VisionProcess``); this thread then only hands
+    frames over and waits, so vision processing does not compete for the
+    GIL with the control loop.
+
+    Capture and processing run in separate threads, connected by a
+    ``FrameRing``: the camera keeps capturing while a frame is processed,
+    and processing always picks up the newest captured frame. Frames
+    captured while processing was busy are dropped (counted in
+    ``ring.dropped``). With ``drop=False``, capture instead waits for
+    processing to take each frame, so that every frame is processed (i.e.
+    to benchmark with a replay).
+
+    Results can be polled (``get_output()``), waited for
+    (``get_output(timeout)``, ``wait_for_newer_than(seq)``), or awaited from
+    asyncio code (``await wait_for_newer_than_async(seq)``). If processing
+    fails, it stops, the exception is kept in ``error``, and all of these
+    raise ``RuntimeError`` (from it) instead of waiting:
+
+    out = mod.get_output(timeout=None)
+    while True:
+        out = mod.wait_for_newer_than(out.seq)
+        ...
     """
-    def __init__(self, led=None):
+    def __init__(
+            self, led=None, yuv=False, source=None, recorder=None,
+            camera=None, drop=True, out_of_process=False, **kwargs):
+
+        super().__init__(daemon=True)
 
-        self.camera = Camera()
-        self.vision = VisionModule(width=640, height=480)
+        if camera is None:
+            camera = Camera(fmt="yuv420" if yuv else "bgr", source=source)
+        yuv = camera.fmt == "yuv420"
+
+        self.camera = camera
+        if out_of_process:
+            self.vision = VisionProcess(
+                fmt=camera.fmt, shape=camera.shape, width=640, height=480,
+                color="yuv" if yuv else "hsv", **kwargs)
+        else:
+            self.vision = VisionModule(
+                width=640, height=480, color="yuv" if yuv else "hsv",
+                **kwargs)
+        self.ring = FrameRing(self.camera.shape)
         self.done = False
+        self.finished = False
+        self.error = None
+        self.drop = drop
 
-        self.capture = False
         self.led = led
+        self.recorder = recorder
+
+        self.__capture_thread = threading.Thread(
+            target=self.__capture_loop, daemon=True)
 
-        # Asynchronous output; designed to be read by much faster loop
-        self.objects = []
+        # Asynchronous output; designed to be read by much faster loop.
+        # Readers wait on ``__cond``, which also signals ``capture`` changes
+        self.objects = None
         self.flag = False
+        self.__cond = threading.Condition()
+        self.__capture = False
+        self.__waiters = []
 
-    def run(self):
-        while threading.main_thread().is_alive() and not self.done:
+    @property
+    def capture(self):
+        """Whether frames are being captured and processed"""
+
+        return self.__capture
+
+    @capture.setter
+    def capture(self, value):
+        with self.__cond:
+            self.__capture = value
+            self.__cond.notify_all()
+
+    def __running(self):
+        return threading.main_thread().is_alive() and not self.done
+
+    def __capture_loop(self):
+        """Capture stage; fills the ring with the newest frames"""
+
+        # Frames are captured straight into ring slots
+        acquired = []
+
+        def acquire():
+            idx, buf = self.ring.acquire()
+            acquired.append(idx)
+            return buf
+
+        while self.__running():
             if self.capture:
-                img = self.camera.capture()
+                for _ in self.camera.stream(acquire=acquire):
+                    self.ring.publish(acquired.pop(), time.time())
+                    if not self.drop:
+                        while not self.ring.wait_taken(timeout=1):
+                            if not self.__running():
+                                return
+                    if not (self.capture and self.__running()):
+                        break
+                else:
+                    # Camera ran out of frames; the slot acquired for the
+                    # next frame is unused
+                    while acquired:
+                        self.ring.cancel(acquired.pop())
+                    self.finished = True
+                    self.capture = False
+            else:
+                # Woken up by ``capture`` and ``stop``; the timeout only
+                # checks on the main thread
+                with self.__cond:
+                    self.__cond.wait_for(
+                        lambda: self.__capture or self.done, timeout=1)
+
+    def __publish(self, output):
+        """Publish a result, and wake up waiting readers"""
+
+        with self.__cond:
+            self.objects = output
+            self.flag = True
+            self.__cond.notify_all()
+
+            waiters = [w for w in self.__waiters if output.seq > w[2]]
+            for w in waiters:
+                self.__waiters.remove(w)
+
+        for loop, future, _ in waiters:
+            loop.call_soon_threadsafe(_resolve, future, output)
+
+    def __fail(self, error):
+        """Stop processing after an error, and pass it to waiting readers"""
+
+        with self.__cond:
+            self.error = error
+            self.done = True
+            self.__cond.notify_all()
+            waiters, self.__waiters = self.__waiters, []
+
+        for loop, future, _ in waiters:
+            loop.call_soon_threadsafe(_reject, future, error)
+
+    def __check(self):
+        """Raise the processing error, if any; call with ``__cond`` held"""
 
+        if self.error is not None:
+            raise RuntimeError("Vision processing failed") from self.error
+
+    def run(self):
+        """Processing stage"""
+
+        self.__capture_thread.start()
+
+        while self.__running():
+            frame = self.ring.take(timeout=0.1)
+            if frame is None:
+                continue
+
+            if self.led is not None:
                 self.led.on()
-                self.objects = self.vision.process(img)
-                self.flag = True
-                self.led.off()
-            else:
-                time.sleep(0.1)
+            try:
+                objects, mask, cvxhull = self.vision.process(
+                    frame.image, fmt=self.camera.fmt)
+                if self.recorder is not None:
+                    self.recorder.record(
+                        frame.image, objects, frame.timestamp, frame.seq)
+            except Exception as e:
+                self.__fail(e)
+                return
+            finally:
+                self.ring.release(frame)
+                if self.led is not None:
+                    self.led.off()
+
+            self.__publish(VisionOutput(
+                objects=objects, mask=mask, cvxhull=cvxhull,
+                seq=frame.seq, timestamp=frame.timestamp,
+                processed=time.time()))
+
+    def stop(self):
+        """Stop capture and processing, and wait for both to finish"""
+
+        with self.__cond:
+            self.done = True
+            self.__cond.notify_all()
+        if self.__capture_thread.is_alive():
+            self.__capture_thread.join()
+        if self.is_alive():
+            self.join()
+        if isinstance(self.vision, VisionProcess):
+            self.vision.close()
 
     def reset(self):
         """Reset module; clears pending results"""
-        self.flag = False
+        with self.__cond:
+            self.flag = False
+
+    def get_output(self, timeout=0):
+        """Get output. If output available, returns a ``VisionOutput``
+        (objects, mask, cvxhull, seq, timestamp, processed); else, returns
+        False.
+
+        Each result is returned once. If ``timeout`` is nonzero, waits up to
+        ``timeout`` seconds (or indefinitely, if None) for a result.
 
-    def get_output(self):
-        """Get output. If output available, returns list of obstacles;
-        else, returns False."""
+        The mask is a view of the vision module's buffers, and is overwritten
+        by the next processed frame. Raises ``RuntimeError`` if processing
+        failed."""
 
-        if self.flag:
+        with self.__cond:
+            if not self.__cond.wait_for(
+                    lambda: self.flag or self.error is not None, timeout):
+                return False
+            if not self.flag:
+                self.__check()
             self.flag = False
             return self.objects
-        else:
+
+    def wait_for_newer_than(self, seq, timeout=None):
+        """Wait for the result of a frame captured after frame ``seq``
+
+        Parameters
+        ----------
+        seq : int
+            Sequence number of the last result seen; 0 for any result
+        timeout : float or None
+            Maximum time to wait, in seconds; waits indefinitely if None
+
+        Returns
+        -------
+        VisionOutput or False
+            Newest result, or False on timeout. Unlike ``get_output``, does
+            not mark the result as read.
+
+        Raises
+        ------
+        RuntimeError
+            If processing failed before a newer result was available
+        """
+
+        def newer():
+            return self.objects is not None and self.objects.seq > seq
+
+        with self.__cond:
+            if not self.__cond.wait_for(
+                    lambda: newer() or self.error is not None, timeout):
+                return False
+            if not newer():
+                self.__check()
+            return self.objects
+
+    async def wait_for_newer_than_async(self, seq, timeout=None):
+        """Awaitable ``wait_for_newer_than``; the event loop is woken up
+        directly by the processing thread, without polling"""
+
+        loop = asyncio.get_running_loop()
+        with self.__cond:
+            if self.objects is not None and self.objects.seq > seq:
+                return self.objects
+            self.__check()
+            waiter = (loop, loop.create_future(), seq)
+            self.__waiters.append(waiter)
+
+        try:
+            return await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
             return False
+        finally:
+            with self.__cond:
+                if waiter in self.__waiters:
+                    self.__waiters.remove(waiter)
+
+
+def _resolve(future, output):
+    """Set a future's result, unless it was cancelled"""
+
+    if not future.done():
+        future.set_result(output)
+
+
+def _reject(future, error):
+    """Fail a future with a processing error, unless it was cancelled"""
+
+    if not future.done():
+        try:
+            raise RuntimeError("Vision processing failed") from error
+        except RuntimeError as e:
+            future.set_exception(e)
+
+
+class Tests(unittest.TestCase):
+
+    def start(self, camera=None, **kwargs):
+
+        if camera is None:
+            camera = Camera(source=FakePiCamera(realtime=False))
+        mod = VisionModuleThread(camera=camera, **kwargs)
+        self.addCleanup(mod.stop)
+        mod.start()
+        return mod
+
+    def wait_async(self, mod):
+        """Await a result from a waiter registered before capture starts"""
+
+        async def wait():
+            task = asyncio.ensure_future(
+                mod.wait_for_newer_than_async(0, timeout=5))
+            await asyncio.sleep(0)
+            mod.capture = True
+            return await task
+
+        return asyncio.run(wait())
+
+    def test_output(self):
+
+        mod = self.start()
+
+        # Nothing is captured yet: waits time out
+        self.assertIs(mod.get_output(timeout=0.1), False)
+        self.assertIs(mod.wait_for_newer_than(0, timeout=0.1), False)
+        self.assertIs(asyncio.run(
+            mod.wait_for_newer_than_async(0, timeout=0.1)), False)
+
+        first = self.wait_async(mod)
+        self.assertGreater(first.seq, 0)
+        self.assertLessEqual(first.timestamp, first.processed)
+
+        out = first
+        for _ in range(3):
+            newer = mod.wait_for_newer_than(out.seq, timeout=5)
+            self.assertGreater(newer.seq, out.seq)
+            out = newer
+        self.assertGreater(mod.get_output(timeout=5).seq, first.seq)
+
+    def test_replay(self):
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "frames.npy")
+            np.save(path, np.stack([
+                np.full((480, 640, 3), 40 * i, dtype=np.uint8)
+                for i in range(5)]))
+            mod = self.start(
+                camera=ReplayCamera(path, realtime=False), drop=False)
+
+            # Every frame is processed, then the replay ends; restarting
+            # capture ends it again right away
+            for _ in range(4):
+                mod.capture = True
+                deadline = time.time() + 5
+                while not mod.finished and time.time() < deadline:
+                    time.sleep(0.01)
+                self.assertTrue(mod.finished)
+                mod.finished = False
+            self.assertEqual(mod.wait_for_newer_than(4, timeout=5).seq, 5)
+            self.assertEqual((mod.ring.published, mod.ring.dropped), (5, 0))
+            mod.stop()
+
+            # Frames were captured straight into the ring's slots, and no
+            # slot is held once the replay ended
+            for _ in mod.ring.buffers:
+                mod.ring.acquire()
+            del mod
+
+    def test_error(self):
+
+        class Failing:
+            def process(self, img, fmt):
+                raise ValueError("bad frame")
+
+        mod = self.start()
+        mod.vision = Failing()
+
+        # Waiting readers are woken up by the error
+        with self.assertRaises(RuntimeError) as ctx:
+            self.wait_async(mod)
+        self.assertIsInstance(ctx.exception.__cause__, ValueError)
+        self.assertIs(mod.error, ctx.exception.__cause__)
+
+        for wait in [
+                lambda: mod.get_output(timeout=5),
+                lambda: mod.wait_for_newer_than(0, timeout=5),
+                lambda: asyncio.run(mod.wait_for_newer_than_async(0))]:
+            with self.assertRaises(RuntimeError):
+                wait()
@@ -0,0 +1,246 @@
+"""Out-of-process vision module
+
+Runs a ``VisionModule`` in a separate process, so that vision processing
+(including its Python-side post-processing) does not hold the GIL of the
+process running the control loop. Frames are handed over through
+``multiprocessing.shared_memory`` instead of being pickled; results come
+back as compact ``objects.OBJECT_DTYPE`` arrays, and the field mask is
+written to shared memory as well.
+
+The worker is started with the "forkserver" (or "spawn") start method, so
+scripts creating a ``VisionProcess`` must guard their entry point with
+``if __name__ == "__main__":``.
+
+Usage
+-----
+mod = VisionProcess(width=640, height=480)
+objects, mask, cvxhull = mod.process(img)
+mod.close()
+"""
+
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import unittest
+
+import cv2
+import numpy as np
+
+from .objects import from_array, to_array
+from . import samples
+
+
+def _frame_shape(width, height, fmt):
+    if fmt == "yuv420":
+        return (height * 3 // 2, width)
+    return (height, width, 3)
+
+
+def _serve(conn, frame_name, mask_name, shape, options):
+    """Worker process main loop"""
+
+    # Imported here so that the module can be loaded without building the
+    # vision module in the parent
+    from .vision import VisionModule
+
+    try:
+        module = VisionModule(**options)
+    except Exception as e:
+        conn.send(("error", repr(e)))
+        return
+
+    frame_shm = shared_memory.SharedMemory(name=frame_name)
+    mask_shm = shared_memory.SharedMemory(name=mask_name)
+    frame = np.ndarray(shape, dtype=np.uint8, buffer=frame_shm.buf)
+    mask_out = np.ndarray(
+        (module.height, module.width), dtype=np.uint8, buffer=mask_shm.buf)
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+        try:
+            _, fmt, want = msg
+            objects, mask, cvxhull = module.process(
+                frame, fmt=fmt, want=want)
+            if mask is not None:
+                np.copyto(mask_out, mask)
+            conn.send((
+                "done", (to_array(objects), mask is not None, cvxhull)))
+        except Exception as e:
+            conn.send(("error", repr(e)))
+
+    del frame, mask_out
+    frame_shm.close()
+    mask_shm.close()
+
+
+class VisionProcess:
+    """``VisionModule`` running in a worker process
+
+    Has the ``VisionModule.process`` interface; ``process`` blocks (without
+    holding the GIL) until the worker returns the results.
+
+    Parameters
+    ----------
+    fmt : str
+        Input format; "bgr" or "yuv420". Frames must be (H, W, 3) BGR
+        images, or (H * 3 / 2, W) I420 buffers.
+    shape : tuple or None
+        Shape of the input frames (i.e. ``Camera.shape``); defaults to
+        frames of the module's (width, height). Other frame sizes are
+        resized by the module, as in ``VisionModule.process``.
+    **options
+        ``VisionModule`` constructor arguments (i.e. ``width``, ``height``,
+        ``color``); the module is built in the worker process.
+    """
+
+    def __init__(self, fmt="bgr", shape=None, **options):
+
+        self.width = options.get("width", 640)
+        self.height = options.get("height", 480)
+        self.fmt = fmt
+        self.options = options
+        if shape is None:
+            shape = _frame_shape(self.width, self.height, fmt)
+        self.shape = tuple(shape)
+
+        self.__frame_shm = shared_memory.SharedMemory(
+            create=True, size=int(np.prod(self.shape)))
+        self.__mask_shm = shared_memory.SharedMemory(
+            create=True, size=self.width * self.height)
+        self.__frame = np.ndarray(
+            self.shape, dtype=np.uint8, buffer=self.__frame_shm.buf)
+        self.__mask = np.ndarray(
+            (self.height, self.width), dtype=np.uint8,
+            buffer=self.__mask_shm.buf)
+
+        # The parent typically runs capture and processing threads; forking
+        # it could leave locks held by those threads locked in the child
+        ctx = multiprocessing.get_context(
+            "forkserver" if "forkserver" in
+            multiprocessing.get_all_start_methods() else "spawn")
+        self.__conn, child = ctx.Pipe()
+        self.__process = ctx.Process(
+            target=_serve, daemon=True,
+            args=(
+                child, self.__frame_shm.name, self.__mask_shm.name,
+                self.shape, options))
+        self.__process.start()
+        child.close()
+
+        # Wait for the worker, so that construction errors show up here
+        self.__receive()
+
+    def __receive(self):
+        """Receive a message from the worker, raising its errors"""
+
+        try:
+            status, payload = self.__conn.recv()
+        except EOFError:
+            raise RuntimeError("Vision worker process exited")
+        if status == "error":
+            raise RuntimeError("Vision worker error: " + payload)
+        return payload
+
+    def process(self, img, fmt=None, want=None, as_array=False):
+        """Process image (see ``VisionModule.process``)
+
+        Parameters
+        ----------
+        img : np.array
+            Input frame, with shape ``shape``; copied to shared memory
+        fmt : str or None
+            Input format; must match the ``fmt`` the worker was started with
+        want : iterable or None
+            Outputs to compute (see ``VisionModule.process``)
+        as_array : bool
+            If True, objects are returned as the ``objects.OBJECT_DTYPE``
+            array received from the worker
+
+        Returns
+        -------
+        Object[] or np.array
+            List of found objects
+        np.array or None
+            Field mask. References shared memory that is overwritten by the
+            next call to ``process``. None if not computed.
+        np.array or None
+            Convex hull of the field, if found
+        """
+
+        if fmt is not None and fmt != self.fmt:
+            raise ValueError(
+                "Worker expects '{}' frames, got '{}'".format(self.fmt, fmt))
+        if img.shape != self.shape:
+            raise ValueError("Expected a frame of shape {}, got {}".format(
+                self.shape, img.shape))
+
+        np.copyto(self.__frame, img)
+        self.__conn.send((
+            "process", self.fmt, None if want is None else set(want)))
+        objects, has_mask, cvxhull = self.__receive()
+
+        if not as_array:
+            objects = from_array(objects)
+        return objects, self.__mask if has_mask else None, cvxhull
+
+    def close(self):
+        """Stop the worker process and release shared memory"""
+
+        if self.__process is None:
+            return
+        try:
+            self.__conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.__process.join(timeout=5)
+        if self.__process.is_alive():
+            self.__process.terminate()
+        self.__process = None
+        self.__conn.close()
+
+        del self.__frame, self.__mask
+        for shm in [self.__frame_shm, self.__mask_shm]:
+            shm.close()
+            shm.unlink()
+
+    def __del__(self):
+        """Destructor method to ensure the worker is stopped"""
+
+        if hasattr(self, "_VisionProcess__process"):
+            self.close()
+
+
+class Tests(unittest.TestCase):
+
+    def test_round_trip(self):
+
+        from .vision import VisionModule
+
+        img = cv2.resize(
+            cv2.imread(os.path.join(samples.BASE_DIR, "1.jpg")), (640, 480))
+        expected = VisionModule(width=640, height=480).process(img)
+
+        mod = VisionProcess(width=640, height=480)
+        names = [mod._VisionProcess__frame_shm.name,
+                 mod._VisionProcess__mask_shm.name]
+        try:
+            # Objects travel as OBJECT_DTYPE arrays, with float32 fields
+            for _ in range(2):
+                objs, mask, cvxhull = mod.process(img, as_array=True)
+                self.assertTrue(np.array_equal(objs, to_array(expected[0])))
+                self.assertTrue(np.array_equal(mask, expected[1]))
+                self.assertTrue(np.array_equal(cvxhull, expected[2]))
+        finally:
+            mod.close()
+
+        # The worker exits and the shared memory is unlinked
+        self.assertIsNone(mod._VisionProcess__process)
+        for name in names:
+            with self.assertRaises(FileNotFoundError):
+                shared_memory.SharedMemory(name=name)